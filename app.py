@@ -2,15 +2,27 @@ import streamlit as st
 import pandas as pd
 import os
 import re
-import subprocess
 import tempfile
 import time
 import glob
 import shutil
+import atexit
 from datetime import datetime
 import sys
 import io
 import threading
+import contextlib
+import traceback
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import ezdxf
+import dxf_compare_dxf
+import dxf_extract_labels
+import dxf_compare_partslist
+import extract_symbols
+import dxf_analyze_structure
+import dxf_hierarchy
 
 # タイトルと概要の設定
 st.title("電気設計支援ツール")
@@ -31,66 +43,147 @@ tool_option = st.sidebar.selectbox(
     ]
 )
 
+# 実行中の出力表示エリアに表示する文字数の上限（長い出力は末尾だけを表示）
+OUTPUT_DISPLAY_LIMIT = 65536
+
+# 結果ファイルの表（Excel/CSV）で画面に表示する最大行数
+DATAFRAME_DISPLAY_ROWS = 10000
+
+# バイナリDXFファイルの先頭22バイト
+BINARY_DXF_SENTINEL = b"AutoCAD Binary DXF\r\n\x1a\x00"
+
+# セッションごとに1つの作業用一時ディレクトリを使い回す（アプリ終了時に削除）
+def get_session_workdir():
+    if "workdir" not in st.session_state:
+        st.session_state["workdir"] = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, st.session_state["workdir"], ignore_errors=True)
+    return st.session_state["workdir"]
+
 # アップロードされたファイルを一時ディレクトリに保存する関数
 def save_uploaded_file(uploaded_file, directory=None):
     if directory is None:
-        directory = tempfile.mkdtemp()
+        directory = get_session_workdir()
     
     if not os.path.exists(directory):
         os.makedirs(directory)
         
     file_path = os.path.join(directory, uploaded_file.name)
     
+    # アップロード内容を丸ごと複製せず、1MiB 単位でファイルへ書き出す
+    uploaded_file.seek(0)
     with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+        shutil.copyfileobj(uploaded_file, f, length=1024 * 1024)
         
     return file_path, directory
 
-# プロセス実行とリアルタイム出力表示用
-def run_process_with_output(cmd, cwd=None):
-    process = subprocess.Popen(
-        cmd, 
-        stdout=subprocess.PIPE, 
-        stderr=subprocess.STDOUT,
-        text=True,
-        cwd=cwd
-    )
-    
-    output = []
-    output_area = st.empty()
-    
-    for line in iter(process.stdout.readline, ''):
-        output.append(line)
-        output_area.text("".join(output))
-        
-    process.stdout.close()
-    return_code = process.wait()
-    
-    if return_code != 0:
-        st.error(f"エラーが発生しました (終了コード: {return_code})")
-        
-    return "".join(output), return_code
+# アップロードされたファイル内容のハッシュ値（キャッシュのキーに使用）
+def get_file_digest(uploaded_file):
+    return hashlib.blake2b(uploaded_file.getbuffer()).hexdigest()
+
+# DXFファイルの読み込み結果を再実行をまたいでキャッシュ（ファイル内容のハッシュ値をキーとする）
+# キャッシュする内容がキーだけで決まるよう、同名のアップロードで上書きされうるファイルではなくアップロード内容から読み込む
+@st.cache_resource(show_spinner=False, max_entries=8)
+def load_dxf(file_digest, _data):
+    if not _data.startswith(BINARY_DXF_SENTINEL):
+        try:
+            # R2007 以降の DXF は UTF-8
+            return ezdxf.read(io.TextIOWrapper(io.BytesIO(_data), encoding="utf-8"))
+        except UnicodeDecodeError:
+            pass
+
+    # バイナリDXFや、UTF-8 以外の文字コード（$DWGCODEPAGE）の古い DXF は、
+    # ハッシュ値を名前にしたファイルに書き出して ezdxf.readfile に判定を任せる
+    file_path = os.path.join(get_session_workdir(), f"{file_digest}.dxf")
+    with open(file_path, "wb") as f:
+        f.write(_data)
+    try:
+        return ezdxf.readfile(file_path)
+    finally:
+        os.remove(file_path)
+
+# ツール実行用のスレッドプール（プロセス全体で1つを使い回し、複数セッションのツールを並行して実行する）
+# 出力は ThreadOutputRouter でスレッドごとに振り分けるため、同時に実行しても混ざらない
+@st.cache_resource(show_spinner=False)
+def get_tool_executor():
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+
+# 標準出力・標準エラー出力への書き込みを、書き込んだスレッドごとの出力先に振り分ける
+# （sys.stdout の差し替えはプロセス全体に効くため、セッションごとのスレッドで redirect_stdout は使えない）
+class ThreadOutputRouter:
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    def _target(self):
+        return getattr(self._local, "target", None) or self._default
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
 
-# コマンド実行関数（リアルタイム出力のためのラッパー）
-def execute_command(cmd, cwd=None):
+    # このスレッドの出力だけを buffer に取り込む
+    @contextlib.contextmanager
+    def capture(self, buffer):
+        previous = getattr(self._local, "target", None)
+        self._local.target = buffer
+        try:
+            yield buffer
+        finally:
+            self._local.target = previous
+
+# 振り分け用のオブジェクトはプロセスで1回だけ sys.stdout / sys.stderr に設定する
+@st.cache_resource(show_spinner=False)
+def get_output_routers():
+    sys.stdout = ThreadOutputRouter(sys.stdout)
+    sys.stderr = ThreadOutputRouter(sys.stderr)
+    return sys.stdout, sys.stderr
+
+# ツール実行関数（サブプロセスを起動せず、プロセス内で各スクリプトの関数を呼び出す）
+def execute_tool(func, *args):
     output_container = st.empty()
-    output_text = ""
-    
-    process = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        universal_newlines=True,
-        cwd=cwd
-    )
-    
-    # リアルタイムでプロセスの出力を表示
-    for line in iter(process.stdout.readline, ''):
-        output_text += line
-        output_container.text(output_text)
-    
-    process.wait()
-    return process.returncode, output_text
+    output_buffer = io.StringIO()
+    stdout_router, stderr_router = get_output_routers()
+
+    def run():
+        # このスレッドの print 出力（標準出力・標準エラー出力）だけをバッファに取り込む
+        with stdout_router.capture(output_buffer), stderr_router.capture(output_buffer):
+            try:
+                return func(*args)
+            except SystemExit as e:
+                return e.code
+            except Exception:
+                traceback.print_exc()
+                return 1
+
+    # ワーカースレッドで実行し、出力をリアルタイムで表示
+    future = get_tool_executor().submit(run)
+    while not future.done():
+        wait([future], timeout=0.1)
+        output_container.text(output_buffer.getvalue()[-OUTPUT_DISPLAY_LIMIT:])
+    result = future.result()
+
+    output_text = output_buffer.getvalue()
+    output_container.text(output_text[-OUTPUT_DISPLAY_LIMIT:])
+
+    # main の戻り値を終了コードに変換
+    if result is None or result is True:
+        returncode = 0
+    elif result is False or not isinstance(result, int):
+        returncode = 1
+    else:
+        returncode = result
+    return returncode, output_text
+
+# 結果ファイルの内容を再実行をまたいでキャッシュ（パスと更新時刻をキーとする）
+@st.cache_data(show_spinner=False, max_entries=16)
+def read_result_file(file_path, mtime):
+    with open(file_path, "rb") as file:
+        return file.read()
 
 # 処理完了後の結果表示
 def show_result_file(file_path, file_type):
@@ -102,53 +195,54 @@ def show_result_file(file_path, file_type):
     if file_type == "dxf":
         st.success(f"DXFファイルが生成されました: {os.path.basename(file_path)}")
         # DXFはダウンロード用リンクのみ提供
-        with open(file_path, "rb") as file:
-            st.download_button(
-                label="DXFファイルをダウンロード",
-                data=file,
-                file_name=os.path.basename(file_path),
-                mime="application/dxf"
-            )
+        st.download_button(
+            label="DXFファイルをダウンロード",
+            data=read_result_file(file_path, os.path.getmtime(file_path)),
+            file_name=os.path.basename(file_path),
+            mime="application/dxf"
+        )
     elif file_type == "txt":
         st.success(f"テキストファイルが生成されました: {os.path.basename(file_path)}")
-        with open(file_path, "r", encoding="utf-8") as file:
-            content = file.read()
-            st.text_area("ファイル内容", content, height=400)
-            st.download_button(
-                label="テキストファイルをダウンロード",
-                data=content,
-                file_name=os.path.basename(file_path),
-                mime="text/plain"
-            )
+        # 表示とダウンロードで同じ読み込み結果を使う
+        content = read_result_file(file_path, os.path.getmtime(file_path))
+        st.text_area("ファイル内容", content.decode("utf-8"), height=400)
+        st.download_button(
+            label="テキストファイルをダウンロード",
+            data=content,
+            file_name=os.path.basename(file_path),
+            mime="text/plain"
+        )
     elif file_type == "md":
         st.success(f"Markdownファイルが生成されました: {os.path.basename(file_path)}")
-        with open(file_path, "r", encoding="utf-8") as file:
-            content = file.read()
-            st.markdown(content)
-            st.download_button(
-                label="Markdownファイルをダウンロード",
-                data=content,
-                file_name=os.path.basename(file_path),
-                mime="text/markdown"
-            )
+        # 表示とダウンロードで同じ読み込み結果を使う
+        content = read_result_file(file_path, os.path.getmtime(file_path))
+        st.markdown(content.decode("utf-8"))
+        st.download_button(
+            label="Markdownファイルをダウンロード",
+            data=content,
+            file_name=os.path.basename(file_path),
+            mime="text/markdown"
+        )
     elif file_type in ["xlsx", "csv"]:
         st.success(f"データファイルが生成されました: {os.path.basename(file_path)}")
         if file_type == "xlsx":
             df = pd.read_excel(file_path)
         else:
-            df = pd.read_csv(file_path, encoding="utf-8-sig")
+            df = pd.read_csv(file_path, engine="c", memory_map=True, low_memory=False, encoding="utf-8-sig")
         
-        st.dataframe(df, height=400)
+        # 表示は先頭の行だけに絞る（ダウンロードファイルは全行）
+        st.dataframe(df.head(DATAFRAME_DISPLAY_ROWS), height=400)
+        if len(df) > DATAFRAME_DISPLAY_ROWS:
+            st.caption(f"全{len(df)}行のうち、先頭{DATAFRAME_DISPLAY_ROWS}行を表示しています")
         
         # ダウンロード用のボタン
-        with open(file_path, "rb") as file:
-            mime_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" if file_type == "xlsx" else "text/csv"
-            st.download_button(
-                label=f"{file_type.upper()}ファイルをダウンロード",
-                data=file,
-                file_name=os.path.basename(file_path),
-                mime=mime_type
-            )
+        mime_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" if file_type == "xlsx" else "text/csv"
+        st.download_button(
+            label=f"{file_type.upper()}ファイルをダウンロード",
+            data=read_result_file(file_path, os.path.getmtime(file_path)),
+            file_name=os.path.basename(file_path),
+            mime=mime_type
+        )
 
 # ------ ツール別の機能実装 ------
 
@@ -161,7 +255,7 @@ if tool_option == "DXF図面比較 (図形要素の変更点を可視化)":
     - 緑色（ADDED）：追加された要素
     - 赤色（REMOVED）：削除された要素
     - 青色（MODIFIED）：変更された要素
-    - 白色（UNCHANGED）：変更なしの要素
+    - 白色（UNCHANGED）：変更なしの要素（「変更なしの要素も出力」を選択した場合のみ）
     """)
     
     # ファイルアップロード
@@ -171,36 +265,34 @@ if tool_option == "DXF図面比較 (図形要素の変更点を可視化)":
     # 許容誤差の設定
     tolerance = st.slider("浮動小数点比較の許容誤差", min_value=1e-10, max_value=1e-2, value=1e-6, format="%.0e")
     
+    include_unchanged = st.checkbox("変更なしの要素も出力", value=False)
+    
     if st.button("比較実行", disabled=(file_a is None or file_b is None)):
         with st.spinner("DXFファイルを比較中..."):
-            # 一時ディレクトリの作成
-            temp_dir = tempfile.mkdtemp()
-            
-            # ファイルを一時ディレクトリに保存
-            file_a_path, _ = save_uploaded_file(file_a, temp_dir)
-            file_b_path, _ = save_uploaded_file(file_b, temp_dir)
+            # 作業用一時ディレクトリの取得
+            temp_dir = get_session_workdir()
             
-            # 出力ファイル名を設定
+            # 出力ファイル名を設定（入力ファイルはアップロード内容から直接読み込むため保存しない）
             output_file = os.path.join(temp_dir, f"{os.path.splitext(file_a.name)[0]}_compared_with_{os.path.splitext(file_b.name)[0]}.dxf")
             
-            # コマンド実行
-            cmd = [
-                "python", "dxf_compare_dxf.py",
-                file_a_path,
-                file_b_path,
-                output_file,
-                "--tolerance", str(tolerance)
-            ]
-            
-            # プロセス実行と出力表示
-            st.text("処理中...")
-            returncode, output = execute_command(cmd)
-            
-            if returncode == 0:
-                # 結果表示
-                show_result_file(output_file, "dxf")
-            else:
-                st.error("DXF比較処理中にエラーが発生しました。")
+            # DXFファイルを読み込む（同じ内容のファイルはキャッシュ済みのドキュメントを再利用）
+            try:
+                doc_a = load_dxf(get_file_digest(file_a), file_a.getvalue())
+                doc_b = load_dxf(get_file_digest(file_b), file_b.getvalue())
+            except Exception as e:
+                doc_a = doc_b = None
+                st.error(f"DXFファイルの読み込みに失敗しました: {str(e)}")
+            
+            if doc_a is not None and doc_b is not None:
+                # ツール実行と出力表示
+                st.text("処理中...")
+                returncode, output = execute_tool(dxf_compare_dxf.compare_docs, doc_a, doc_b, output_file, tolerance, include_unchanged)
+                
+                if returncode == 0:
+                    # 結果表示
+                    show_result_file(output_file, "dxf")
+                else:
+                    st.error("DXF比較処理中にエラーが発生しました。")
 
 # DXF部品ラベル抽出ツール
 elif tool_option == "DXFラベル抽出":
@@ -228,8 +320,8 @@ elif tool_option == "DXFラベル抽出":
     
     if st.button("抽出実行", disabled=(dxf_file is None)):
         with st.spinner("DXFファイルからラベルを抽出中..."):
-            # 一時ディレクトリの作成
-            temp_dir = tempfile.mkdtemp()
+            # 作業用一時ディレクトリの取得
+            temp_dir = get_session_workdir()
             
             # ファイルを一時ディレクトリに保存
             dxf_file_path, _ = save_uploaded_file(dxf_file, temp_dir)
@@ -237,27 +329,26 @@ elif tool_option == "DXFラベル抽出":
             # 出力ファイル名を設定
             output_file = os.path.join(temp_dir, f"{os.path.splitext(dxf_file.name)[0]}_labels.txt")
             
-            # コマンド実行
-            cmd = [
-                "python", "dxf_extract_labels.py",
+            # 引数の組み立て
+            args = [
                 dxf_file_path,
                 output_file
             ]
             
             if filter_option:
-                cmd.append("--filter")
+                args.append("--filter")
             else:
-                cmd.append("--no-filter")
+                args.append("--no-filter")
                 
             if sort_option[1] != "none":
-                cmd.extend(["--sort", sort_option[1]])
+                args.extend(["--sort", sort_option[1]])
                 
             if verbose_option:
-                cmd.append("--verbose")
+                args.append("--verbose")
             
-            # プロセス実行と出力表示
+            # ツール実行と出力表示
             st.text("処理中...")
-            returncode, output = execute_command(cmd)
+            returncode, output = execute_tool(dxf_extract_labels.main, args)
             
             if returncode == 0:
                 # 結果表示
@@ -282,8 +373,8 @@ elif tool_option == "部品リスト比較":
     
     if st.button("比較実行", disabled=(file_a is None or file_b is None)):
         with st.spinner("部品リストを比較中..."):
-            # 一時ディレクトリの作成
-            temp_dir = tempfile.mkdtemp()
+            # 作業用一時ディレクトリの取得
+            temp_dir = get_session_workdir()
             
             # ファイルを一時ディレクトリに保存
             file_a_path, _ = save_uploaded_file(file_a, temp_dir)
@@ -292,20 +383,19 @@ elif tool_option == "部品リスト比較":
             # 出力ファイル名を設定
             output_file = os.path.join(temp_dir, f"{os.path.splitext(file_a.name)[0]}_vs_{os.path.splitext(file_b.name)[0]}.md")
             
-            # コマンド実行
-            cmd = [
-                "python", "dxf_compare_partslist.py",
+            # 引数の組み立て
+            args = [
                 file_a_path,
                 file_b_path,
                 output_file
             ]
             
             if verbose_option:
-                cmd.append("--verbose")
+                args.append("--verbose")
             
-            # プロセス実行と出力表示
+            # ツール実行と出力表示
             st.text("処理中...")
-            returncode, output = execute_command(cmd)
+            returncode, output = execute_tool(dxf_compare_partslist.main, args)
             
             if returncode == 0:
                 # 結果表示
@@ -327,8 +417,8 @@ elif tool_option == "回路記号リスト抽出 (Excel部品表から)":
     
     if st.button("抽出実行", disabled=(excel_file is None)):
         with st.spinner("Excelファイルから回路記号を抽出中..."):
-            # 一時ディレクトリの作成
-            temp_dir = tempfile.mkdtemp()
+            # 作業用一時ディレクトリの取得
+            temp_dir = get_session_workdir()
             
             # ファイルを一時ディレクトリに保存
             excel_file_path, _ = save_uploaded_file(excel_file, temp_dir)
@@ -336,16 +426,15 @@ elif tool_option == "回路記号リスト抽出 (Excel部品表から)":
             # 出力ファイル名を設定
             output_file = os.path.join(temp_dir, f"{os.path.splitext(excel_file.name)[0]}_circuit_symbols.txt")
             
-            # コマンド実行
-            cmd = [
-                "python", "extract_symbols.py",
+            # 引数の組み立て
+            args = [
                 excel_file_path,
                 output_file
             ]
             
-            # プロセス実行と出力表示
+            # ツール実行と出力表示
             st.text("処理中...")
-            returncode, output = execute_command(cmd)
+            returncode, output = execute_tool(extract_symbols.main, args)
             
             if returncode == 0:
                 # 結果表示
@@ -376,8 +465,8 @@ elif tool_option == "DXF構造分析":
     
     if st.button("分析実行", disabled=(dxf_file is None)):
         with st.spinner("DXFファイルを分析中..."):
-            # 一時ディレクトリの作成
-            temp_dir = tempfile.mkdtemp()
+            # 作業用一時ディレクトリの取得
+            temp_dir = get_session_workdir()
             
             # ファイルを一時ディレクトリに保存
             dxf_file_path, _ = save_uploaded_file(dxf_file, temp_dir)
@@ -385,22 +474,24 @@ elif tool_option == "DXF構造分析":
             # 出力ファイル名を設定
             output_file = os.path.join(temp_dir, f"{os.path.splitext(dxf_file.name)[0]}_structure.{output_format[1]}")
             
-            # コマンド実行
-            cmd = [
-                "python", "dxf_structure_record.py",
+            # 引数の組み立て
+            args = [
                 dxf_file_path,
                 output_file
             ]
             
             if output_format[1] == "csv":
-                cmd.append("--csv")
+                args.append("--csv")
                 
             if split_option:
-                cmd.append("--split")
+                args.append("--split")
+                # 作業ディレクトリは使い回すため、前回の分割ファイルを削除しておく
+                for old_file in glob.glob(os.path.join(temp_dir, f"{os.path.splitext(dxf_file.name)[0]}_structure_*.{output_format[1]}")):
+                    os.remove(old_file)
             
-            # プロセス実行と出力表示
+            # ツール実行と出力表示
             st.text("処理中...")
-            returncode, output = execute_command(cmd)
+            returncode, output = execute_tool(dxf_analyze_structure.main, args)
             
             if returncode == 0:
                 # 結果表示
@@ -438,8 +529,8 @@ elif tool_option == "DXF階層構造表示":
     
     if st.button("階層構造表示", disabled=(dxf_file is None)):
         with st.spinner("DXFファイルの階層構造を解析中..."):
-            # 一時ディレクトリの作成
-            temp_dir = tempfile.mkdtemp()
+            # 作業用一時ディレクトリの取得
+            temp_dir = get_session_workdir()
             
             # ファイルを一時ディレクトリに保存
             dxf_file_path, _ = save_uploaded_file(dxf_file, temp_dir)
@@ -447,16 +538,15 @@ elif tool_option == "DXF階層構造表示":
             # 出力ファイル名を設定
             output_file = os.path.join(temp_dir, f"{os.path.splitext(dxf_file.name)[0]}_hierarchy.md")
             
-            # コマンド実行
-            cmd = [
-                "python", "dxf_hierarchy.py",
+            # 引数の組み立て
+            args = [
                 dxf_file_path,
                 output_file
             ]
             
-            # プロセス実行と出力表示
+            # ツール実行と出力表示
             st.text("処理中...")
-            returncode, output = execute_command(cmd)
+            returncode, output = execute_tool(dxf_hierarchy.main, args)
             
             if returncode == 0:
                 # 結果表示
@@ -1,44 +1,26 @@
 #!/usr/bin/env python
 import sys
-import ezdxf
 import argparse
-import pandas as pd
 import os
-from io import StringIO
-
-# バージョンに応じた TagWriter のインポート
-try:
-    from ezdxf.lldxf.writer import TagWriter  # ezdxf >= 0.19
-except ImportError:
-    from ezdxf.lldxf.tagwriter import TagWriter  # ezdxf < 0.19
-
-def get_group_code_meaning(code):
-    code_meanings = {
-        0: "Entity Type", 1: "Primary Text String", 2: "Name", 3: "Additional Text",
-        5: "Handle", 6: "Linetype", 7: "Text Style Name", 8: "Layer Name", 9: "Variable Name",
-        10: "X Coordinate (Main)", 20: "Y Coordinate (Main)", 30: "Z Coordinate (Main)",
-        40: "Double Precision Value", 50: "Angle", 62: "Color Number", 70: "Integer Value",
-        210: "X Direction Vector", 220: "Y Direction Vector", 230: "Z Direction Vector", 999: "Comment"
-    }
-    return code_meanings.get(code, "Other")
+import re
+import csv
+import itertools
+import numbers
+import zipfile
+from xml.sax.saxutils import escape
+# グループコードの意味・出力するテーブル・タグの収集は階層構造表示と共通
+from dxf_hierarchy import GROUP_CODE_MEANINGS, TABLE_ATTRS, collect_tags
+
+# 構造分析結果の列名
+STRUCTURE_COLUMNS = ['Section', 'Entity', 'GroupCode', 'GroupCode Definition', 'Value']
 
 def extract_entity_data(section_name, entity):
     rows = []
     entity_type = entity.dxftype()
 
-    buffer = StringIO()
-    tagwriter = TagWriter(buffer)
-    entity.export_dxf(tagwriter)
-    buffer.seek(0)
-    lines = buffer.readlines()
-
-    for i in range(0, len(lines)-1, 2):
-        code_line = lines[i].strip()
-        value_line = lines[i+1].strip()
-        if code_line.isdigit():
-            code = int(code_line)
-            meaning = get_group_code_meaning(code)
-            rows.append([section_name, entity_type, code, meaning, value_line])
+    for code, value in collect_tags(entity):
+        meaning = GROUP_CODE_MEANINGS.get(code, "Other")
+        rows.append([section_name, entity_type, code, meaning, value])
 
     return rows
 
@@ -49,44 +31,175 @@ def extract_table_data(section_name, table_entry):
         rows.append([section_name, entry_type, "-", "TABLE Entry", f"{key} = {value}"])
     return rows
 
-def analyze_dxf_structure(dxf_file):
-    doc = ezdxf.readfile(dxf_file)
-    all_rows = []
-
+def iter_structure_rows(doc):
+    """DXFの構造を、ヘッダー・テーブルエントリ・エンティティごとの行のまとまりとして順に返す"""
     # HEADER
-    for varname in doc.header.varnames():
-        value = doc.header.get(varname)
-        all_rows.append(['HEADER', 'HEADER_VAR', 9, "Variable Name", f"{varname} = {value}"])
+    yield [['HEADER', 'HEADER_VAR', 9, "Variable Name", f"{varname} = {doc.header.get(varname)}"]
+           for varname in doc.header.varnames()]
 
     # TABLES
-    for table_name, table in {
-        'LAYERS': doc.layers,
-        'LTYPE': doc.linetypes,
-        'STYLES': doc.styles,
-        'DIMSTYLES': doc.dimstyles,
-        'UCS': doc.ucs
-    }.items():
+    for table_name, attr in TABLE_ATTRS:
+        table = getattr(doc, attr)
         for entry in table:
-            all_rows.extend(extract_table_data(f"TABLES({table_name})", entry))
+            yield extract_table_data(f"TABLES({table_name})", entry)
 
     # BLOCKS
     for block in doc.blocks:
         for entity in block:
-            all_rows.extend(extract_entity_data('BLOCKS', entity))
+            yield extract_entity_data('BLOCKS', entity)
 
     # ENTITIES
     msp = doc.modelspace()
     for entity in msp:
-        all_rows.extend(extract_entity_data('ENTITIES', entity))
+        yield extract_entity_data('ENTITIES', entity)
 
     # OBJECTS
     for obj in doc.objects:
-        all_rows.extend(extract_entity_data('OBJECTS', obj))
+        yield extract_entity_data('OBJECTS', obj)
 
     # CLASSES コメント行
-    all_rows.append(['CLASSES', 'INFO', '', '', 'CLASSES セクションは存在すればファイル内に含まれます'])
+    yield [['CLASSES', 'INFO', '', '', 'CLASSES セクションは存在すればファイル内に含まれます']]
+
+def analyze_dxf_structure(doc):
+    """
+    DXFの構造を列ごとのリスト（列名 -> 値のリスト）として返す
+    （行リストを全件ためずに列へ振り分け、DataFrame を一度で組み立てられるようにする）
+    """
+    columns = {name: [] for name in STRUCTURE_COLUMNS}
+    column_lists = list(columns.values())
+
+    for rows in iter_structure_rows(doc):
+        # 行のまとまりを転置して、各列のリストに追加する
+        for column, values in zip(column_lists, zip(*rows)):
+            column.extend(values)
+
+    return columns
+
+def write_structure_csv(doc, csv_file):
+    """
+    DXFの構造を DataFrame を作らずに CSV へ直接書き出し、書き出した行数を返す
+    （pandas の to_csv と同じ形式: UTF-8 BOM 付き、ヘッダー行あり、改行は OS の既定）
+    """
+    row_count = 0
+    with open(csv_file, 'w', encoding='utf-8-sig', newline='', buffering=1 << 20) as f:
+        writer = csv.writer(f, lineterminator=os.linesep)
+        writer.writerow(STRUCTURE_COLUMNS)
+        for rows in iter_structure_rows(doc):
+            writer.writerows(rows)
+            row_count += len(rows)
+    return row_count
 
-    return all_rows
+# --- XLSX の直接書き出し（値だけのシート1枚を、ライブラリを介さず XML で出力する） ---
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+XLSX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+XLSX_SHEET_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+XLSX_SHEET_FOOTER = '</sheetData></worksheet>'
+# XML 1.0 で使えない制御文字（openpyxl と同じく、含まれていればエラーにする）
+XLSX_ILLEGAL_CHARACTERS = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+
+def xlsx_column_letter(index):
+    """0 始まりの列番号を Excel の列名（A, B, ..., Z, AA, ...）に変換"""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+def xlsx_cell(ref, value):
+    """1セル分の XML を返す（数値はそのまま、文字列はインライン文字列、空文字列と None は空セル）"""
+    if value is None or value == '' or value != value:  # value != value は NaN
+        return ''
+    if isinstance(value, numbers.Real) and not isinstance(value, bool):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    text = str(value)
+    if XLSX_ILLEGAL_CHARACTERS.search(text):
+        raise ValueError(f"Excel に書き込めない制御文字が含まれています: {text!r}")
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+def write_xlsx_raw(rows, columns, filename, max_rows=None, chunk_rows=10000):
+    """
+    行の並びをシート1枚の XLSX として直接書き出し、書き出したデータ行数を返す
+    （書式のない値だけのシートなので、openpyxl や xlsxwriter のセルオブジェクトを作らずに XML を zip へ流し込む）
+    max_rows を超える行があった場合は書き出しを中止してファイルを削除し、None を返す
+    """
+    letters = [xlsx_column_letter(i) for i in range(len(columns))]
+    completed = False
+    try:
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES)
+            zf.writestr('_rels/.rels', XLSX_ROOT_RELS)
+            zf.writestr('xl/workbook.xml', XLSX_WORKBOOK)
+            zf.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS)
+            zf.writestr('xl/styles.xml', XLSX_STYLES)
+            with zf.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+                sheet.write(XLSX_SHEET_HEADER.encode('utf-8'))
+                parts = []
+                row_number = 0
+                for row_number, row in enumerate(itertools.chain([tuple(columns)], rows), start=1):
+                    # 見出し行を除いた行数が上限を超えたら中止する
+                    if max_rows is not None and row_number - 1 > max_rows:
+                        return None
+                    cells = ''.join(xlsx_cell(f"{letter}{row_number}", value) for letter, value in zip(letters, row))
+                    parts.append(f'<row r="{row_number}">{cells}</row>')
+                    # 一定行数ごとにまとめて書き出す
+                    if len(parts) >= chunk_rows:
+                        sheet.write(''.join(parts).encode('utf-8'))
+                        parts.clear()
+                parts.append(XLSX_SHEET_FOOTER)
+                sheet.write(''.join(parts).encode('utf-8'))
+        completed = True
+        return row_number - 1
+    finally:
+        # 中止・エラー時は書きかけのファイルを残さない
+        if not completed and os.path.exists(filename):
+            os.remove(filename)
+
+def save_excel(df, filename):
+    """DataFrame を Excel ファイルに保存（値だけのシートなので XML を直接書き出す）"""
+    write_xlsx_raw(df.itertuples(index=False, name=None), df.columns, filename)
 
 def save_by_section(df, base_filename):
     """Save data split by section to multiple Excel files"""
@@ -104,13 +217,16 @@ def save_by_section(df, base_filename):
         
         try:
             section_df = df[df['Section'] == section]
+            if ext.lower() == '.csv':
+                section_df.to_csv(section_filename, index=False, encoding='utf-8-sig')
+                print(f"保存完了: {section_filename} ({len(section_df)} 行)")
             # Excel行数制限チェック
-            if ext.lower() == '.xlsx' and len(section_df) > 1000000:
+            elif ext.lower() == '.xlsx' and len(section_df) > 1000000:
                 csv_filename = f"{base_name}_{section_safe}.csv"
                 section_df.to_csv(csv_filename, index=False, encoding='utf-8-sig')
                 print(f"セクション '{section}' が大きすぎるため CSV として保存: {csv_filename} ({len(section_df)} 行)")
             else:
-                section_df.to_excel(section_filename, index=False)
+                save_excel(section_df, section_filename)
                 print(f"保存完了: {section_filename} ({len(section_df)} 行)")
         except Exception as e:
             # エラーが発生した場合はCSVにフォールバック
@@ -135,13 +251,13 @@ def ensure_dxf_extension(filename):
         print(f"⚠️  警告: 入力ファイルの拡張子が '.dxf' ではありません: {ext}")
     return filename
 
-if __name__ == "__main__":
+def main(argv=None):
     parser = argparse.ArgumentParser(description='DXF構造をExcelまたはCSVに出力')
     parser.add_argument('input_dxf', help='入力DXFファイル（拡張子がない場合は .dxf が自動追加）')
     parser.add_argument('output_file', help='出力ファイル（拡張子がない場合は .xlsx が自動追加）')
     parser.add_argument('--csv', action='store_true', help='強制的にCSV形式で出力')
     parser.add_argument('--split', action='store_true', help='セクションごとに別ファイルに分割')
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # 入力ファイルに .dxf 拡張子を追加（必要な場合）
     input_dxf = ensure_dxf_extension(args.input_dxf)
@@ -156,44 +272,74 @@ if __name__ == "__main__":
     # 入力ファイルが存在するか確認
     if not os.path.exists(input_dxf):
         print(f"❌ エラー: 入力ファイルが見つかりません: {input_dxf}")
-        sys.exit(1)
+        return 1
     
     try:
         # DXF構造データを抽出
         print(f"DXFファイル分析中: {input_dxf}")
-        data = analyze_dxf_structure(input_dxf)
-        df = pd.DataFrame(data, columns=['Section', 'Entity', 'GroupCode', 'GroupCode Definition', 'Value'])
         
-        row_count = len(df)
-        print(f"抽出されたデータ: {row_count} 行")
+        # ezdxf / pandas の読み込みは重いため、--help や引数エラーで終わる場合に読み込まないよう、使う時点で import する
+        import ezdxf
+        doc = ezdxf.readfile(input_dxf)
         
         # Excelの行数制限をチェック
         EXCEL_ROW_LIMIT = 1000000  # 実際の制限より少し小さい値を設定
         
         if args.split:
+            import pandas as pd
+            data = analyze_dxf_structure(doc)
+            df = pd.DataFrame(data, columns=STRUCTURE_COLUMNS)
+            del data
+            # 繰り返しの多い文字列列はカテゴリ型にしてメモリを抑える
+            # （GroupCode は "-" や空文字列が混ざるため、数値型にはせずそのまま残す）
+            df = df.astype({'Section': 'category', 'Entity': 'category', 'GroupCode Definition': 'category'})
+            print(f"抽出されたデータ: {len(df)} 行")
+            
             # セクションごとに分割して保存
             save_by_section(df, output_file)
-        elif args.csv or row_count > EXCEL_ROW_LIMIT or output_file.endswith('.csv'):
+            return 0
+        
+        # 分割しない場合は DataFrame を作らず、抽出しながら書き出す
+        csv_file = output_file if output_file.endswith('.csv') else os.path.splitext(output_file)[0] + '.csv'
+        
+        if args.csv or output_file.endswith('.csv'):
             # CSV形式で保存
-            csv_file = output_file if output_file.endswith('.csv') else os.path.splitext(output_file)[0] + '.csv'
-            df.to_csv(csv_file, index=False, encoding='utf-8-sig')
+            row_count = write_structure_csv(doc, csv_file)
+            print(f"抽出されたデータ: {row_count} 行")
             print(f"CSV形式出力完了 出力ファイル: {csv_file}")
             if output_file.endswith('.xlsx') and row_count > EXCEL_ROW_LIMIT:
                 print(f"⚠️  注意: データが大きすぎるため ({row_count} 行 > {EXCEL_ROW_LIMIT} 行制限)、Excel形式ではなくCSV形式で保存しました。")
+            return 0
+        
+        # Excel形式で保存（行数が上限を超えたら中止して CSV で保存し直す）
+        try:
+            rows = itertools.chain.from_iterable(iter_structure_rows(doc))
+            row_count = write_xlsx_raw(rows, STRUCTURE_COLUMNS, output_file, max_rows=EXCEL_ROW_LIMIT)
+        except Exception as e:
+            # エラーが発生した場合はCSVにフォールバック
+            row_count = write_structure_csv(doc, csv_file)
+            print(f"抽出されたデータ: {row_count} 行")
+            print(f"Excel形式で保存中にエラーが発生しました: {e}")
+            print(f"代わりにCSV形式で保存しました: {csv_file}")
+            return 0
+        
+        if row_count is None:
+            row_count = write_structure_csv(doc, csv_file)
+            print(f"抽出されたデータ: {row_count} 行")
+            print(f"CSV形式出力完了 出力ファイル: {csv_file}")
+            if output_file.endswith('.xlsx'):
+                print(f"⚠️  注意: データが大きすぎるため ({row_count} 行 > {EXCEL_ROW_LIMIT} 行制限)、Excel形式ではなくCSV形式で保存しました。")
         else:
-            # Excel形式で保存
-            try:
-                df.to_excel(output_file, index=False)
-                print(f"Excel形式出力完了 出力ファイル: {output_file}")
-            except Exception as e:
-                # エラーが発生した場合はCSVにフォールバック
-                csv_file = os.path.splitext(output_file)[0] + '.csv'
-                df.to_csv(csv_file, index=False, encoding='utf-8-sig')
-                print(f"Excel形式で保存中にエラーが発生しました: {e}")
-                print(f"代わりにCSV形式で保存しました: {csv_file}")
+            print(f"抽出されたデータ: {row_count} 行")
+            print(f"Excel形式出力完了 出力ファイル: {output_file}")
     
     except Exception as e:
         print(f"❌ エラー: 処理中に例外が発生しました: {e}")
         import traceback
         traceback.print_exc()
-        sys.exit(1)
\ No newline at end of file
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -1,228 +1,328 @@
 import sys
 import ezdxf
-from ezdxf.addons import Importer
-import math
+from ezdxf.entities import factory
+from ezdxf.math import Vec3
 import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
-def compare_dxf_files_and_generate_dxf(file_a, file_b, output_file, tolerance=1e-6):
+# numba がインストールされていれば座標の量子化をJITコンパイルする（なければNumPy版を使用）
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# 比較結果DXFのレイヤー名と色
+RESULT_LAYERS = (
+    ('ADDED', 3),      # 緑色: 追加された要素
+    ('REMOVED', 1),    # 赤色: 削除された要素
+    ('MODIFIED', 5),   # 青色: 変更された要素
+    ('UNCHANGED', 7),  # 白色: 変更なしの要素
+)
+
+def compare_dxf_files_and_generate_dxf(file_a, file_b, output_file, tolerance=1e-6, include_unchanged=False):
     try:
-        # DXFファイルを読み込む
-        doc_a = ezdxf.readfile(file_a)
-        doc_b = ezdxf.readfile(file_b)
+        # DXFファイルを読み込む（2ファイルは独立しているので並行して読む）
+        with ThreadPoolExecutor(2) as executor:
+            future_a = executor.submit(ezdxf.readfile, file_a)
+            future_b = executor.submit(ezdxf.readfile, file_b)
+            doc_a, doc_b = future_a.result(), future_b.result()
+    except Exception as e:
+        print(f"エラーが発生しました: {str(e)}")
+        return False
+
+    return compare_docs(doc_a, doc_b, output_file, tolerance, include_unchanged)
 
+def compare_docs(doc_a, doc_b, output_file, tolerance=1e-6, include_unchanged=False):
+    """
+    読み込み済みの2つのDXFドキュメントを比較し、差分をDXFファイルに出力
+    （doc_a / doc_b は変更しないため、キャッシュしたドキュメントを渡してもよい）
+    include_unchanged が False の場合、変更なしの要素は出力しない
+    """
+    try:
         # 比較結果を格納する新しいDXFドキュメントを作成
         doc_result = ezdxf.new('R2010')
 
         # レイヤーを作成
-        doc_result.layers.new(name='ADDED', dxfattribs={'color': 3})  # 緑色: 追加された要素
-        doc_result.layers.new(name='REMOVED', dxfattribs={'color': 1})  # 赤色: 削除された要素
-        doc_result.layers.new(name='MODIFIED', dxfattribs={'color': 5})  # 青色: 変更された要素
-        doc_result.layers.new(name='UNCHANGED', dxfattribs={'color': 7})  # 白色: 変更なしの要素
+        for layer_name, color in RESULT_LAYERS:
+            doc_result.layers.new(name=layer_name, dxfattribs={'color': color})
 
         # モデルスペースを取得
         msp_a = doc_a.modelspace()
         msp_b = doc_b.modelspace()
         msp_result = doc_result.modelspace()
 
-        # エンティティのハンドルをキーとした辞書を作成
-        entities_a = {}
-        entities_b = {}
-
-        # ファイルAのエンティティを処理
-        for entity in msp_a:
-            key = get_entity_key(entity, tolerance)
-            entities_a[key] = entity
+        # エンティティの識別キーをキーとした辞書を作成（A/Bの走査は独立しているので並行して行う）
+        with ThreadPoolExecutor(2) as executor:
+            future_a = executor.submit(build_entity_keys, msp_a, tolerance)
+            future_b = executor.submit(build_entity_keys, msp_b, tolerance)
+            entities_a, entities_b = future_a.result(), future_b.result()
 
-        # ファイルBのエンティティを処理
-        for entity in msp_b:
-            key = get_entity_key(entity, tolerance)
-            entities_b[key] = entity
+        # Aの辞書を1回走査して 削除／共通 の要素を振り分け（キーごとの検索は1回だけ）
+        removed = []
+        common_pairs = []
+        for key, entity_a in entities_a.items():
+            entity_b = entities_b.get(key)
+            if entity_b is None:
+                removed.append(entity_a)
+            else:
+                common_pairs.append((entity_a, entity_b))
+        added = [entity_b for key, entity_b in entities_b.items() if key not in entities_a]
 
         # 削除された要素（ファイルAにあってファイルBにない要素）
-        for key, entity in entities_a.items():
-            if key not in entities_b:
-                # エンティティをコピーして赤色レイヤーに配置
-                copy_entity_to_result(entity, msp_result, 'REMOVED')
+        for entity in removed:
+            # エンティティをコピーして赤色レイヤーに配置
+            copy_entity_to_result(entity, msp_result, 'REMOVED')
 
         # 追加された要素（ファイルBにあってファイルAにない要素）
-        for key, entity in entities_b.items():
-            if key not in entities_a:
-                # エンティティをコピーして緑色レイヤーに配置
-                copy_entity_to_result(entity, msp_result, 'ADDED')
-            else:
-                # 両方のファイルに存在する要素
-                entity_a = entities_a[key]
-                if is_entity_modified(entity_a, entity, tolerance):
-                    # 変更された要素は青色レイヤーに配置
-                    copy_entity_to_result(entity, msp_result, 'MODIFIED')
-                else:
-                    # 変更なしの要素は白色レイヤーに配置
-                    copy_entity_to_result(entity, msp_result, 'UNCHANGED')
-
-        # 結果を保存
-        doc_result.saveas(output_file)
+        for entity in added:
+            # エンティティをコピーして緑色レイヤーに配置
+            copy_entity_to_result(entity, msp_result, 'ADDED')
+
+        # 両方のファイルに存在する要素（変更の有無は一括で判定）
+        modified = find_modified_entities(common_pairs, tolerance)
+        for (_, entity), is_modified in zip(common_pairs, modified):
+            if is_modified:
+                # 変更された要素は青色レイヤーに配置
+                copy_entity_to_result(entity, msp_result, 'MODIFIED')
+            elif include_unchanged:
+                # 変更なしの要素は白色レイヤーに配置（--include-unchanged 指定時のみ）
+                copy_entity_to_result(entity, msp_result, 'UNCHANGED')
+
+        # 結果を保存（大きめのバッファを使い、書き込みのシステムコールをまとめる）
+        with open(output_file, 'wt', encoding=doc_result.output_encoding, errors='dxfreplace', buffering=1 << 20) as f:
+            doc_result.write(f)
         return True
     except Exception as e:
         print(f"エラーが発生しました: {str(e)}")
         return False
 
+# 座標値を量子化してキーに含めるエンティティタイプ
+# dxftype -> (数値属性を取り出す関数, 文字列属性を取り出す関数)
+KEY_COORD_ATTRIBS = {
+    'LINE': (
+        lambda e: (e.dxf.start[0], e.dxf.start[1], e.dxf.end[0], e.dxf.end[1]),
+        lambda e: (e.dxf.layer, e.dxf.linetype),
+    ),
+    'CIRCLE': (
+        lambda e: (e.dxf.center[0], e.dxf.center[1], e.dxf.radius),
+        lambda e: (),
+    ),
+    'ARC': (
+        lambda e: (e.dxf.center[0], e.dxf.center[1], e.dxf.radius, e.dxf.start_angle, e.dxf.end_angle),
+        lambda e: (),
+    ),
+    'TEXT': (
+        lambda e: (e.dxf.insert[0], e.dxf.insert[1]),
+        lambda e: (e.dxf.text,),
+    ),
+    'MTEXT': (
+        lambda e: (e.dxf.insert[0], e.dxf.insert[1]),
+        lambda e: (e.text,),
+    ),
+}
+
+def build_entity_keys(entities, tolerance=1e-6):
+    """
+    エンティティ群から 識別キー -> エンティティ の辞書を作成
+    座標値はエンティティタイプごとにNumPy配列へまとめて一括で量子化する
+    （同じキーのエンティティが複数ある場合は後のものが残る）
+    """
+    entities = list(entities)
+    keys = [None] * len(entities)
+
+    # エンティティタイプごとに振り分け
+    buckets = {}
+    for i, entity in enumerate(entities):
+        entity_type = entity.dxftype()
+        if entity_type in KEY_COORD_ATTRIBS:
+            buckets.setdefault(entity_type, []).append(i)
+        else:
+            keys[i] = get_entity_key(entity, tolerance)
+
+    # タイプごとに座標配列を作成して量子化し、量子化済みの値をそのままキーのタプルに並べる
+    # 例: ('LINE', qx1, qy1, qx2, qy2, layer, linetype)
+    for entity_type, indices in buckets.items():
+        get_coords, get_attribs = KEY_COORD_ATTRIBS[entity_type]
+        coords = np.array([get_coords(entities[i]) for i in indices], dtype=np.float64)
+        rows = quantize(coords, tolerance).tolist()
+        for i, row in zip(indices, rows):
+            keys[i] = (entity_type, *row, *get_attribs(entities[i]))
+
+    return dict(zip(keys, entities))
+
 def get_entity_key(entity, tolerance=1e-6):
     """
     エンティティを一意に識別するためのキーを生成
     """
     entity_type = entity.dxftype()
+    key_attribs = KEY_COORD_ATTRIBS.get(entity_type)
 
-    # エンティティタイプに応じて識別キーを生成
-    if entity_type == 'LINE':
-        # LINEエンティティのキーを生成
-        return f"LINE_{round_float(entity.dxf.start[0], tolerance)}_{round_float(entity.dxf.start[1], tolerance)}_{round_float(entity.dxf.end[0], tolerance)}_{round_float(entity.dxf.end[1], tolerance)}_{entity.dxf.layer}_{entity.dxf.linetype}"
-    elif entity_type == 'CIRCLE':
-        return f"CIRCLE_{round_float(entity.dxf.center[0], tolerance)}_{round_float(entity.dxf.center[1], tolerance)}_{round_float(entity.dxf.radius, tolerance)}"
-    elif entity_type == 'ARC':
-        return f"ARC_{round_float(entity.dxf.center[0], tolerance)}_{round_float(entity.dxf.center[1], tolerance)}_{round_float(entity.dxf.radius, tolerance)}_{round_float(entity.dxf.start_angle, tolerance)}_{round_float(entity.dxf.end_angle, tolerance)}"
-    elif entity_type == 'TEXT':
-        return f"TEXT_{round_float(entity.dxf.insert[0], tolerance)}_{round_float(entity.dxf.insert[1], tolerance)}_{entity.dxf.text}"
-    elif entity_type == 'MTEXT':
-        return f"MTEXT_{round_float(entity.dxf.insert[0], tolerance)}_{round_float(entity.dxf.insert[1], tolerance)}_{entity.text}"
-    elif entity_type == 'LEADER':
-        # LEADERエンティティのキーを生成
-        return f"LEADER_{entity.dxf.layer}_{entity.dxf.linetype}"  # 例：レイヤーと線種をキーにする
-    else:
-        # その他のエンティティタイプの場合は、最小限の属性でキーを生成
-        return f"{entity_type}_{entity.dxf.layer}_{entity.dxf.linetype}"
+    if key_attribs is None:
+        # その他のエンティティタイプ（LEADERを含む）は、タイプ・レイヤー・線種をキーにする
+        return (entity_type, entity.dxf.layer, entity.dxf.linetype)
 
-def round_float(value, tolerance=1e-6):
+    # 座標値を持つエンティティは build_entity_keys と同じ形式のキーを生成
+    get_coords, get_attribs = key_attribs
+    coords = np.array([get_coords(entity)], dtype=np.float64)
+    return (entity_type, *quantize(coords, tolerance)[0].tolist(), *get_attribs(entity))
+
+def quantize(coords, tolerance=1e-6):
     """
-    浮動小数点数を丸める
+    浮動小数点数の配列を許容誤差単位に丸める
+    （-0.0 は 0.0 に揃える）
     """
-    return round(value / tolerance) * tolerance
+    coords = np.ascontiguousarray(coords, dtype=np.float64)
+    if _quantize_jit is not None:
+        return _quantize_jit(coords, float(tolerance))
+    return np.rint(coords / tolerance) + 0.0
+
+if njit is not None:
+    # fastmath は -0.0 の正規化や除算の丸めを変えてしまうため使用しない
+    # parallel=True は使わない（A/B を並行処理するスレッドやセッションから同時に呼ばれると、
+    # numba の workqueue スレッドレイヤーがプロセスごと異常終了するため。配列も小さい）
+    @njit(cache=True)
+    def _quantize_jit(coords, tolerance):
+        out = np.empty_like(coords)
+        for i in range(coords.shape[0]):
+            for j in range(coords.shape[1]):
+                out[i, j] = np.rint(coords[i, j] / tolerance) + 0.0
+        return out
+else:
+    _quantize_jit = None
+
+# 座標を許容誤差付きで比較するエンティティタイプ（比較する属性は KEY_COORD_ATTRIBS と同じ）
+# それ以外のタイプ（CIRCLE、ARC、LEADER など）はレイヤーと線種だけを比較する
+MODIFIED_CHECK_TYPES = ('LINE', 'TEXT', 'MTEXT')
 
-def is_entity_modified(entity_a, entity_b, tolerance=1e-6):
+def find_modified_entities(pairs, tolerance=1e-6):
     """
-    2つのエンティティが異なるかどうかを判定
+    (エンティティA, エンティティB) の組のリストについて、変更されたかどうかを一括で判定
+    座標値はエンティティタイプごとにNumPy配列にまとめて比較する
     """
-    # エンティティタイプが異なる場合は変更されたとみなす
-    if entity_a.dxftype() != entity_b.dxftype():
-        return True
+    modified = np.zeros(len(pairs), dtype=bool)
 
-    # 属性を比較
-    entity_type = entity_a.dxftype()
-    if entity_type == 'LEADER':
-        # LEADERエンティティの属性を比較
-        if entity_a.dxf.layer != entity_b.dxf.layer:
-            return True
-        if entity_a.dxf.linetype != entity_b.dxf.linetype:
-            return True
-    elif entity_type == 'LINE':
-        # LINEエンティティの属性を比較
-        if not math.isclose(entity_a.dxf.start[0], entity_b.dxf.start[0], rel_tol=tolerance, abs_tol=tolerance):
-            return True
-        if not math.isclose(entity_a.dxf.start[1], entity_b.dxf.start[1], rel_tol=tolerance, abs_tol=tolerance):
-            return True
-        if not math.isclose(entity_a.dxf.end[0], entity_b.dxf.end[0], rel_tol=tolerance, abs_tol=tolerance):
-            return True
-        if not math.isclose(entity_a.dxf.end[1], entity_b.dxf.end[1], rel_tol=tolerance, abs_tol=tolerance):
-            return True
-        if entity_a.dxf.layer != entity_b.dxf.layer:
-            return True
-        if entity_a.dxf.linetype != entity_b.dxf.linetype:
-            return True
-    elif entity_type == 'TEXT':
-        if entity_a.dxf.text != entity_b.dxf.text:
-            return True
-        if not math.isclose(entity_a.dxf.insert[0], entity_b.dxf.insert[0], rel_tol=tolerance, abs_tol=tolerance):
-            return True
-        if not math.isclose(entity_a.dxf.insert[1], entity_b.dxf.insert[1], rel_tol=tolerance, abs_tol=tolerance):
-            return True
-    elif entity_type == 'MTEXT':
-        if entity_a.text != entity_b.text:
-            return True
-        if not math.isclose(entity_a.dxf.insert[0], entity_b.dxf.insert[0], rel_tol=tolerance, abs_tol=tolerance):
-            return True
-        if not math.isclose(entity_a.dxf.insert[1], entity_b.dxf.insert[1], rel_tol=tolerance, abs_tol=tolerance):
-            return True
-    else:
-        # その他のエンティティタイプの場合は、最小限の属性で比較
-        if entity_a.dxf.layer != entity_b.dxf.layer:
-            return True
-        if entity_a.dxf.linetype != entity_b.dxf.linetype:
-            return True
+    # エンティティタイプごとに振り分け
+    buckets = {}
+    for i, (entity_a, entity_b) in enumerate(pairs):
+        entity_type = entity_a.dxftype()
+        if entity_type != entity_b.dxftype():
+            # エンティティタイプが異なる場合は変更されたとみなす
+            modified[i] = True
+        elif entity_type in MODIFIED_CHECK_TYPES:
+            buckets.setdefault(entity_type, []).append(i)
+        else:
+            # その他のエンティティタイプの場合は、最小限の属性で比較
+            modified[i] = (entity_a.dxf.layer != entity_b.dxf.layer or
+                           entity_a.dxf.linetype != entity_b.dxf.linetype)
+
+    for entity_type, indices in buckets.items():
+        get_coords, get_attribs = KEY_COORD_ATTRIBS[entity_type]
+        coords_a = np.array([get_coords(pairs[i][0]) for i in indices], dtype=np.float64)
+        coords_b = np.array([get_coords(pairs[i][1]) for i in indices], dtype=np.float64)
+
+        # math.isclose(a, b, rel_tol=tolerance, abs_tol=tolerance) と同じ判定を配列全体に適用
+        limit = np.maximum(tolerance * np.maximum(np.abs(coords_a), np.abs(coords_b)), tolerance)
+        coords_changed = (np.abs(coords_a - coords_b) > limit).any(axis=1)
+        attribs_changed = np.array([get_attribs(pairs[i][0]) != get_attribs(pairs[i][1]) for i in indices])
+        modified[indices] = coords_changed | attribs_changed
+
+    return modified
+
+# 結果DXFに追加するエンティティのひな形（エンティティタイプとレイヤーごとに1つ作成し、複製して使う）
+_ENTITY_TEMPLATES = {}
+
+def _add_from_template(msp_result, entity_type, layer_name, dxfattribs):
+    """
+    ひな形のエンティティを複製して属性を設定し、結果のモデルスペースに追加
+    属性値は読み込み済みのエンティティから取り出した値なので、add_* のような属性ごとの検証を省略して設定する
+    """
+    template = _ENTITY_TEMPLATES.get((entity_type, layer_name))
+    if template is None:
+        template = factory.new(entity_type, dxfattribs={'layer': layer_name})
+        _ENTITY_TEMPLATES[(entity_type, layer_name)] = template
+
+    new_entity = template.copy()
+    for key, value in dxfattribs.items():
+        if value is not None:
+            new_entity.dxf.unprotected_set(key, value)
+    msp_result.add_entity(new_entity)
+    return new_entity
+
+def _to_float(value):
+    # 未設定（None）の属性はそのまま未設定として扱う
+    return None if value is None else float(value)
+
+def _copy_line(entity, msp_result, layer_name):
+    _add_from_template(msp_result, 'LINE', layer_name, {
+        'start': Vec3(entity.dxf.start),
+        'end': Vec3(entity.dxf.end),
+    })
 
-    # すべての比較をパスした場合は変更なしとみなす
-    return False
+def _copy_circle(entity, msp_result, layer_name):
+    _add_from_template(msp_result, 'CIRCLE', layer_name, {
+        'center': Vec3(entity.dxf.center),
+        'radius': float(entity.dxf.radius),
+    })
+
+def _copy_arc(entity, msp_result, layer_name):
+    _add_from_template(msp_result, 'ARC', layer_name, {
+        'center': Vec3(entity.dxf.center),
+        'radius': float(entity.dxf.radius),
+        'start_angle': float(entity.dxf.start_angle),
+        'end_angle': float(entity.dxf.end_angle),
+    })
+
+def _copy_text(entity, msp_result, layer_name):
+    _add_from_template(msp_result, 'TEXT', layer_name, {
+        'text': str(entity.dxf.text),
+        'insert': Vec3(entity.dxf.insert),
+        'height': float(entity.dxf.height),
+        'rotation': _to_float(entity.dxf.rotation) if hasattr(entity.dxf, 'rotation') else 0.0,
+    })
+
+def _copy_mtext(entity, msp_result, layer_name):
+    new_entity = _add_from_template(msp_result, 'MTEXT', layer_name, {
+        'insert': Vec3(entity.dxf.insert),
+        'char_height': float(entity.dxf.char_height),
+        'width': _to_float(entity.dxf.width) if hasattr(entity.dxf, 'width') else 0.0,
+    })
+    new_entity.text = str(entity.text)
+
+def _copy_leader(entity, msp_result, layer_name):
+    # LEADERの形状を再現するために、LINEエンティティに分解してコピーする
+    try:
+        points = entity.get_arrow_block_insert()
+        msp_result.add_line(points[0], points[1], dxfattribs={'layer': layer_name})
+    except:
+        _copy_placeholder(entity, msp_result, layer_name)
+
+def _copy_placeholder(entity, msp_result, layer_name):
+    # その他のエンティティタイプの場合は簡易的な表示
+    msp_result.add_text(
+        text=f"[{entity.dxftype()}]",
+        dxfattribs={
+            'layer': layer_name,
+            'insert': getattr(entity.dxf, 'insert', (0, 0, 0)) if hasattr(entity.dxf, 'insert') else (0, 0, 0),
+            'height': 2.5
+        }
+    )
+
+# エンティティタイプごとのコピー処理（登録のないタイプは簡易表示）
+COPY_FUNCS = {
+    'LINE': _copy_line,
+    'CIRCLE': _copy_circle,
+    'ARC': _copy_arc,
+    'TEXT': _copy_text,
+    'MTEXT': _copy_mtext,
+    'LEADER': _copy_leader,
+}
 
 def copy_entity_to_result(entity, msp_result, layer_name):
     """
     エンティティを結果のモデルスペースにコピーし、指定されたレイヤーに配置
     """
-    entity_type = entity.dxftype()
-
-    # エンティティタイプに応じてコピー処理
-    if entity_type == 'LINE':
-        msp_result.add_line(
-            start=entity.dxf.start,
-            end=entity.dxf.end,
-            dxfattribs={'layer': layer_name}
-        )
-    elif entity_type == 'CIRCLE':
-        msp_result.add_circle(
-            center=entity.dxf.center,
-            radius=entity.dxf.radius,
-            dxfattribs={'layer': layer_name}
-        )
-    elif entity_type == 'ARC':
-        msp_result.add_arc(
-            center=entity.dxf.center,
-            radius=entity.dxf.radius,
-            start_angle=entity.dxf.start_angle,
-            end_angle=entity.dxf.end_angle,
-            dxfattribs={'layer': layer_name}
-        )
-    elif entity_type == 'TEXT':
-        msp_result.add_text(
-            text=entity.dxf.text,
-            dxfattribs={
-                'layer': layer_name,
-                'insert': entity.dxf.insert,
-                'height': entity.dxf.height,
-                'rotation': entity.dxf.rotation if hasattr(entity.dxf, 'rotation') else 0
-            }
-        )
-    elif entity_type == 'MTEXT':
-        msp_result.add_mtext(
-            text=entity.text,
-            dxfattribs={
-                'layer': layer_name,
-                'insert': entity.dxf.insert,
-                'char_height': entity.dxf.char_height,
-                'width': entity.dxf.width if hasattr(entity.dxf, 'width') else 0
-            }
-        )
-    elif entity_type == 'LEADER':
-        # LEADERエンティティのコピー処理
-        # LEADERの形状を再現するために、LINEエンティティに分解してコピーする
-        try:
-            points = entity.get_arrow_block_insert()
-            msp_result.add_line(points[0],points[1],dxfattribs={'layer': layer_name})
-        except:
-             msp_result.add_text(
-                text=f"[LEADER]",
-                dxfattribs={
-                    'layer': layer_name,
-                    'insert': getattr(entity.dxf, 'insert', (0, 0, 0)) if hasattr(entity.dxf, 'insert') else (0, 0, 0),
-                    'height': 2.5
-                }
-            )
-    else:
-        # その他のエンティティタイプの場合は簡易的な表示
-        msp_result.add_text(
-            text=f"[{entity_type}]",
-            dxfattribs={
-                'layer': layer_name,
-                'insert': getattr(entity.dxf, 'insert', (0, 0, 0)) if hasattr(entity.dxf, 'insert') else (0, 0, 0),
-                'height': 2.5
-            }
-        )
+    COPY_FUNCS.get(entity.dxftype(), _copy_placeholder)(entity, msp_result, layer_name)
 
 def ensure_file_extension(filename, default_ext):
     """ファイル名に拡張子がない場合、デフォルトの拡張子を追加する"""
@@ -242,14 +342,15 @@ def get_default_output_filename(file_a, file_b):
 
 import argparse
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description='2つのDXFファイルを比較し、図形要素の差分をDXF形式で出力（図形差分を可視化）')
     parser.add_argument('file_a', help='基準となるDXFファイル (A)')
     parser.add_argument('file_b', help='比較対象のDXFファイル (B)')
     parser.add_argument('output_dxf', nargs='?', help='出力先のDXFファイル名（.dxf）。指定しない場合は自動生成')
     parser.add_argument('--tolerance', type=float, default=1e-6, help='浮動小数点比較の許容誤差（例: 1e-6）')
+    parser.add_argument('--include-unchanged', action='store_true', help='変更なしの要素も UNCHANGED レイヤーに出力する')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # 入力ファイル名に拡張子を追加
     file_a = ensure_file_extension(args.file_a, '.dxf')
@@ -267,10 +368,10 @@ def main():
     # ファイル存在チェック
     if not os.path.exists(file_a):
         print(f"エラー: ファイル '{file_a}' が見つかりません。")
-        sys.exit(1)
+        return 1
     if not os.path.exists(file_b):
         print(f"エラー: ファイル '{file_b}' が見つかりません。")
-        sys.exit(1)
+        return 1
 
     # 出力ディレクトリの存在確認と作成
     output_dir = os.path.dirname(output_dxf)
@@ -280,18 +381,20 @@ def main():
             print(f"出力ディレクトリ '{output_dir}' を作成しました。")
         except Exception as e:
             print(f"エラー: 出力ディレクトリ '{output_dir}' を作成できません: {str(e)}")
-            sys.exit(1)
+            return 1
 
     if not output_dxf.endswith('.dxf'):
         print("⚠️  警告: 出力ファイルの拡張子は '.dxf' である必要があります。")
         output_dxf += '.dxf'
         print(f"出力ファイル名を '{output_dxf}' に変更しました。")
 
-    if compare_dxf_files_and_generate_dxf(file_a, file_b, output_dxf, args.tolerance):
+    if compare_dxf_files_and_generate_dxf(file_a, file_b, output_dxf, args.tolerance, args.include_unchanged):
         print(f"DXFファイル比較完了 出力ファイル： {output_dxf}")
     else:
         print("DXFファイル比較 失敗")
-        sys.exit(1)
+        return 1
+
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
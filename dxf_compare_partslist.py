@@ -6,29 +6,39 @@ import os
 import sys
 from collections import Counter
 
-def normalize_label(label):
-    """ラベルを正規化する（空白を削除し、大文字に変換）"""
-    if label is None:
-        return ""
-    return label.strip().upper()
-
 def load_labels_from_file(file_path):
     """ファイルからラベルを読み込み、正規化する"""
-    labels = []
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                label = line.strip()
-                if label:  # 空行を無視
-                    # ラベルを正規化（大文字変換・トリム）
-                    label = normalize_label(label)
-                    labels.append(label)
+        # ファイル全体を1MiB 単位のバッファで一度に読み込む
+        with open(file_path, 'r', encoding='utf-8', buffering=1 << 20) as f:
+            data = f.read()
+        # 行ごとに正規化（大文字変換・トリム）し、空行を無視する
+        # （テキストモードで改行は '\n' に統一済みのため、行の区切りは1行ずつ読む場合と同じ）
+        # 同じラベルは何度も現れるため、intern して1つの文字列オブジェクトを共有する
+        labels = [sys.intern(label) for label in (line.strip().upper() for line in data.split('\n')) if label]
         return labels
     except Exception as e:
         # エラーメッセージは標準エラー出力へ
         print(f"エラー: ファイル '{file_path}' の読み込みに失敗しました: {str(e)}", file=sys.stderr)
         sys.exit(1) # エラー終了
 
+def counter_total(counter):
+    """Counter の値の合計を返す（Python 3.10 以降は Counter.total() を使用）"""
+    total = getattr(counter, 'total', None)
+    if total is not None:
+        return total()
+    return sum(counter.values())
+
+def generate_missing_section(title, missing):
+    """不足ラベルのセクション（見出しとラベル一覧）をマークダウンの行として1行ずつ生成する"""
+    yield f"## {title}\n"
+    if missing:
+        # ユニークなラベルだけをソートし、個数分繰り返して出力（個数表示はしない）
+        for label in sorted(missing):
+            yield f"- {label}\n" * missing[label]
+    else:
+        yield "- なし\n"
+
 def compare_label_files(dxf_labels_file, circuit_symbols_file, output_file, verbose=False):
     """2つのラベルファイルを比較し、結果をマークダウン形式で出力する"""
     try:
@@ -50,60 +60,54 @@ def compare_label_files(dxf_labels_file, circuit_symbols_file, output_file, verb
         dxf_counter = Counter(dxf_labels)
         circuit_counter = Counter(circuit_symbols)
 
-        # 図面に不足しているラベル（回路記号にはあるが図面にない）
-        missing_in_dxf = circuit_counter - dxf_counter
+        if len(dxf_counter) == len(dxf_labels) and len(circuit_counter) == len(circuit_symbols):
+            # どちらのラベルも重複がない場合（個数がすべて1）は、キーの差集合だけで求まる
+            missing_in_dxf = Counter(circuit_counter.keys() - dxf_counter.keys())
+            missing_in_circuit = Counter(dxf_counter.keys() - circuit_counter.keys())
+        else:
+            # 図面に不足しているラベル（回路記号にはあるが図面にない）
+            missing_in_dxf = circuit_counter - dxf_counter
 
-        # 回路記号に不足しているラベル（図面にあるが回路記号にない）
-        missing_in_circuit = dxf_counter - circuit_counter
+            # 回路記号に不足しているラベル（図面にあるが回路記号にない）
+            missing_in_circuit = dxf_counter - circuit_counter
 
         # 不足しているラベルの総数を計算
-        missing_in_dxf_total_count = sum(missing_in_dxf.values())
-        missing_in_circuit_total_count = sum(missing_in_circuit.values())
+        missing_in_dxf_total_count = counter_total(missing_in_dxf)
+        missing_in_circuit_total_count = counter_total(missing_in_circuit)
 
-        # 共通するユニークラベル数
-        common_unique_labels_count = len(set(dxf_counter.keys()) & set(circuit_counter.keys()))
+        # 共通するユニークラベル数（キーのビュー同士で積を取り、一時的な集合を作らない）
+        common_unique_labels_count = len(dxf_counter.keys() & circuit_counter.keys())
 
         if verbose:
             print(f"共通ユニークラベル数: {common_unique_labels_count}", file=sys.stderr)
             print(f"図面不足総数: {missing_in_dxf_total_count}", file=sys.stderr)
             print(f"回路記号不足総数: {missing_in_circuit_total_count}", file=sys.stderr)
 
-        # マークダウン形式で出力を生成
-        output = []
-        output.append("# 図面ラベルと回路記号の差分比較結果\n")
-
-        output.append("## 処理概要")
-        output.append(f"- 図面ラベル数: {len(dxf_labels)} (ユニーク: {len(dxf_counter)})")
-        output.append(f"- 回路記号数: {len(circuit_symbols)} (ユニーク: {len(circuit_counter)})")
-        output.append(f"- 共通ユニークラベル数: {common_unique_labels_count}")
-        output.append(f"- 図面に不足しているラベル総数: {missing_in_dxf_total_count}") # 総数を表示
-        output.append(f"- 回路記号に不足しているラベル総数: {missing_in_circuit_total_count}") # 総数を表示
-        output.append("")
-
-        output.append("## 図面に不足しているラベル（回路記号リストには存在する）")
-        if missing_in_dxf:
-            # ★修正点: elements() でラベルを個数分展開し、ソートして出力
-            missing_labels_expanded = sorted(list(missing_in_dxf.elements()))
-            for symbol in missing_labels_expanded:
-                output.append(f"- {symbol}") # 個数表示を削除し、個数分出力
-        else:
-            output.append("- なし")
-        output.append("") # セクション間の見やすさのために空行を追加
-
-        output.append("## 回路記号リストに不足しているラベル（図面には存在する）")
-        if missing_in_circuit:
-            # ★修正点: elements() でラベルを個数分展開し、ソートして出力
-            missing_labels_expanded = sorted(list(missing_in_circuit.elements()))
-            for label in missing_labels_expanded:
-                output.append(f"- {label}") # 個数表示を削除し、個数分出力
-        else:
-            output.append("- なし")
-        output.append("") # 末尾にも空行を追加
+        # マークダウン形式の出力を1行ずつ（改行付きで）生成
+        def generate_report():
+            yield "# 図面ラベルと回路記号の差分比較結果\n\n"
+
+            yield "## 処理概要\n"
+            yield f"- 図面ラベル数: {len(dxf_labels)} (ユニーク: {len(dxf_counter)})\n"
+            yield f"- 回路記号数: {len(circuit_symbols)} (ユニーク: {len(circuit_counter)})\n"
+            yield f"- 共通ユニークラベル数: {common_unique_labels_count}\n"
+            yield f"- 図面に不足しているラベル総数: {missing_in_dxf_total_count}\n" # 総数を表示
+            yield f"- 回路記号に不足しているラベル総数: {missing_in_circuit_total_count}\n" # 総数を表示
+            yield "\n"
+
+            yield from generate_missing_section("図面に不足しているラベル（回路記号リストには存在する）", missing_in_dxf)
+            yield "\n" # セクション間の見やすさのために空行を追加
+
+            yield from generate_missing_section("回路記号リストに不足しているラベル（図面には存在する）", missing_in_circuit)
 
-        # 結果をファイルに書き込み
+        # 結果をファイルに書き込み（一度だけ UTF-8 にエンコードし、バイナリモードで1回の write で書き込む）
         try:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write("\n".join(output))
+            report = "".join(generate_report())
+            if os.linesep != "\n":
+                # テキストモードで書き込んだ場合と同じく、改行はプラットフォームの改行コードにする
+                report = report.replace("\n", os.linesep)
+            with open(output_file, 'wb') as f:
+                f.write(report.encode('utf-8'))
             if verbose:
                  print(f"比較結果を '{output_file}' に出力しました", file=sys.stderr)
         except Exception as e:
@@ -136,7 +140,7 @@ def get_default_output_filename(dxf_labels_file, circuit_symbols_file):
     name_circuit, _ = os.path.splitext(base_circuit)
     return f"{name_dxf}_vs_{name_circuit}.md"
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description='2つの部品リストファイル（テキスト形式）を比較し、差分をマークダウン形式で出力します。',
         formatter_class=argparse.RawTextHelpFormatter
@@ -147,7 +151,7 @@ def main():
     parser.add_argument('output_file', nargs='?', help='比較結果の出力ファイル (.md)。指定しない場合は自動生成')
     parser.add_argument('--verbose', '-v', action='store_true', help='詳細な処理情報を標準エラー出力に表示する')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # 入力ファイルに拡張子を追加
     dxf_labels_file = ensure_file_extension(args.dxf_labels_file, '.txt')
@@ -3,11 +3,39 @@
 
 import sys
 import os
-import ezdxf
 import argparse
 import re
+import functools
+
+# --- 正規表現 (呼び出しごとにコンパイル・キャッシュ検索しないよう、モジュール読み込み時にコンパイル) ---
+BRACKET_PATTERN = re.compile(r'\([^)]*\)')                       # 括弧とその内容
+SINGLE_LETTER_NUMBER_PATTERN = re.compile(r'^[A-Z][0-9]+$')        # 英大文字1文字+数字
+SINGLE_LETTER_DOT_PATTERN = re.compile(r'^[A-Z][0-9]+\.[0-9]+$')   # 英大文字1文字+数字+ドット+数字
+ALPHA_PLUSMINUS_PATTERN = re.compile(r'^[A-Z]+[\+\-]$')           # 英字+[+/-]
+ALNUM_PREFIX_PATTERN = re.compile(r'^[A-Z0-9]+')                  # 先頭の英大文字・数字部分
+
+# --- 括弧削除前のフィルター条件 (1つの正規表現にまとめ、一致したグループ名から理由を引く) ---
+# 数字で始まるかどうかは str.isdigit() と同じ判定にするため、正規表現には含めない
+# 英小文字で始まるかどうかは正規化前のラベルで判定するため、正規表現には含めない
+EARLY_FILTER_PATTERN = re.compile(
+    r'(?P<paren>\()'      # ( で始まる
+    r'|(?P<gnd>.*GND)'    # GND を含む
+    r'|(?P<awg>AWG)'      # AWG で始まる
+    r'|(?P<star>☆)'       # ☆ で始まる
+    r'|(?P<note>注)',     # 注 で始まる
+    re.DOTALL
+)
+EARLY_FILTER_REASONS = {
+    'paren': "( で始まる",
+    'gnd': "GND を含む",
+    'awg': "AWG で始まる",
+    'star': "☆ で始まる",
+    'note': "注 で始まる",
+}
 
 # --- ヘルパー関数 (変更なし) ---
+# 同じラベルは図面内で何度も現れるため、正規化結果もラベルごとにキャッシュする
+@functools.lru_cache(maxsize=65536)
 def normalize_label(label):
     """ラベルを正規化（大文字化、トリム、全角スペース置換）"""
     if label is None:
@@ -19,20 +47,18 @@ def remove_all_brackets(label):
     if label is None:
         return "", False
     original_label = label
-    modified_label = label
-    pattern = re.compile(r'\([^)]*\)')
-    prev_label = None
-    while pattern.search(modified_label):
-        if prev_label == modified_label:
-            print(f"警告: 括弧削除で予期せぬパターン。処理を中断します: '{original_label}'", file=sys.stderr)
-            break
-        prev_label = modified_label
-        modified_label = pattern.sub('', modified_label)
+    # 一致は必ず1文字以上削除するので、置換数が0になるまで繰り返せば収束する
+    modified_label, count = BRACKET_PATTERN.subn('', label)
+    while count:
+        modified_label, count = BRACKET_PATTERN.subn('', modified_label)
     modified_label = modified_label.strip()
     bracket_found = modified_label != original_label
     return modified_label, bracket_found
 
 # --- is_filtered_label (デバッグ出力削除) ---
+# 同じラベルは図面内で何度も現れるため、判定結果をラベルごとにキャッシュする
+# （Streamlit アプリから繰り返し呼ばれてもメモリが増え続けないよう上限を設ける）
+@functools.lru_cache(maxsize=65536)
 def is_filtered_label(label):
     """ラベルがフィルター条件に合致するか判断 (デバッグ出力なし)"""
     original_label = label
@@ -45,14 +71,11 @@ def is_filtered_label(label):
 
     # --- フィルター条件 (括弧削除前にチェック) ---
     if not normalized: return True, "空文字列", None
-    if normalized.startswith('('): return True, "( で始まる", None
     if normalized[0].isdigit(): return True, "数字で始まる", None
-    if 'GND' in normalized: return True, "GND を含む", None
-    if normalized.startswith('AWG'): return True, "AWG で始まる", None
+    match = EARLY_FILTER_PATTERN.match(normalized)
+    if match: return True, EARLY_FILTER_REASONS[match.lastgroup], None
     stripped_original = original_label.strip() if original_label else ""
     if stripped_original and stripped_original[0].islower(): return True, "英小文字で始まる", None
-    if normalized.startswith('☆'): return True, "☆ で始まる", None
-    if normalized.startswith('注'): return True, "注 で始まる", None
 
     # --- 括弧削除処理 ---
     modified_label, bracket_found = remove_all_brackets(normalized)
@@ -66,23 +89,20 @@ def is_filtered_label(label):
 
     # --- 括弧削除後のフィルター条件 ---
     reason_prefix = "括弧削除後、" if bracket_found and modified_label != normalized else ""
-    single_letter_number_pattern = r'^[A-Z][0-9]+$'
-    single_letter_dot_pattern_strict = r'^[A-Z][0-9]+\.[0-9]+$'
-    alpha_plusminus_pattern = r'^[A-Z]+[\+\-]$'
 
     if current_label.isalpha() and current_label.isupper() and len(current_label) <= 2:
         return True, reason_prefix + "英大文字だけで2文字以下", None
-    if re.match(single_letter_number_pattern, current_label):
+    if SINGLE_LETTER_NUMBER_PATTERN.match(current_label):
         return True, reason_prefix + "英大文字1文字+数字", None
-    if re.match(single_letter_dot_pattern_strict, current_label):
+    if SINGLE_LETTER_DOT_PATTERN.match(current_label):
         return True, reason_prefix + "英大文字1文字+数字+ドット+数字", None
-    if re.match(alpha_plusminus_pattern, current_label):
+    if ALPHA_PLUSMINUS_PATTERN.match(current_label):
         return True, reason_prefix + "英字+[+/-]", None
     if ' ' in current_label and len(current_label.split()) > 1:
         return True, reason_prefix + "英文字列と空白を複数含む", None
 
     # --- 後続文字削除処理 ---
-    match = re.match(r'^[A-Z0-9]+', current_label)
+    match = ALNUM_PREFIX_PATTERN.match(current_label)
     if match:
         extracted_part = match.group(0)
         if extracted_part != current_label:
@@ -93,7 +113,7 @@ def is_filtered_label(label):
             if not current_label: return True, reason_prefix_trail + "空文字列", None
             if current_label.isalpha() and current_label.isupper() and len(current_label) <= 2:
                  return True, reason_prefix_trail + "英大文字だけで2文字以下", None
-            if re.match(single_letter_number_pattern, current_label):
+            if SINGLE_LETTER_NUMBER_PATTERN.match(current_label):
                  return True, reason_prefix_trail + "英大文字1文字+数字", None
 
     # --- 最終判断 ---
@@ -106,8 +126,66 @@ def is_filtered_label(label):
     return False, final_reason, current_label
 
 # --- extract_labels_from_dxf (セミコロン区切りで4つ目の要素を抽出するように変更) ---
+def iter_mtext_labels(msp, info):
+    """
+    モデルスペースのMTEXTから4番目のセグメントをラベルとして1つずつ返す
+    （リストにためずにフィルター処理へ流す。抽出数とスキップ情報は info に記録）
+    """
+    # MTEXT エンティティだけを走査する
+    for entity in msp.query('MTEXT'):
+        try:
+            text = entity.text
+            # セミコロンで分割し、4つ目の要素（インデックス3）を取得
+            # （4つ目より後ろは使わないので、分割は4回までにとどめる）
+            segments = text.split(';', 4)
+            if len(segments) >= 4:  # 少なくとも4つのセグメントがあることを確認
+                label = segments[3].strip()
+                if label:
+                    info["total_extracted"] += 1
+                    # 同じラベルは何度も現れるため、intern して1つの文字列オブジェクトを共有する
+                    yield sys.intern(label)
+            else:
+                info["skipped_count"] += 1
+                info["skipped_labels"].append((entity.dxftype(), "セミコロン区切りの4番目の要素が存在しない"))
+        except AttributeError:
+             info["skipped_count"] += 1
+             info["skipped_labels"].append((entity.dxftype(), "AttributeError"))
+        except Exception as e:
+            info["skipped_count"] += 1
+            info["skipped_labels"].append((entity.dxftype(), str(e)))
+            print(f"警告: エンティティ処理スキップ: {entity.dxftype()} - {str(e)}", file=sys.stderr)
+
+def filter_raw_labels(raw_labels, info):
+    """抽出したラベルにフィルターを適用し、出力するラベルを返す（除外理由は info に記録）"""
+    processed_labels = []
+    for label in raw_labels:
+        try:
+            exclude, reason, result_label = is_filtered_label(label)
+            if not exclude:
+                if result_label:
+                    processed_labels.append(result_label)
+            elif reason:
+                 info["filtered_labels_info"].append((label, reason))
+        except Exception as e:
+            info["skipped_count"] += 1
+            info["skipped_labels"].append((label, f"Filtering error: {str(e)}"))
+            print(f"警告: ラベルフィルタリング中にエラー: '{label}' - {str(e)}", file=sys.stderr)
+    return processed_labels
+
+def normalize_raw_labels(raw_labels):
+    """抽出したラベルを正規化だけして返す（フィルターなしの場合）"""
+    processed_labels = []
+    for label in raw_labels:
+        normalized_lbl = normalize_label(label)
+        if normalized_lbl:
+            processed_labels.append(normalized_lbl)
+    return processed_labels
+
 def extract_labels_from_dxf(input_dxf, filter_labels=True, sort_order='asc'):
     """DXFからMTEXTエンティティの4番目のセグメント（3つ目のセミコロンの後）を抽出・フィルタリング"""
+    # ezdxf の読み込みは重いため、--help や引数エラーで終わる場合に読み込まないよう、使う時点で import する
+    import ezdxf
+
     info = {
         "total_extracted": 0, "filtered_count": 0, "skipped_count": 0,
         "final_count": 0, "skipped_labels": [], "filtered_labels_info": []
@@ -115,58 +193,19 @@ def extract_labels_from_dxf(input_dxf, filter_labels=True, sort_order='asc'):
 
     try:
         doc = ezdxf.readfile(input_dxf)
-        msp = doc.modelspace()
-        raw_labels = []
-
-        for entity in msp:
-            try:
-                if entity.dxftype() == 'MTEXT':
-                    text = entity.text
-                    # セミコロンで分割し、4つ目の要素（インデックス3）を取得
-                    segments = text.split(';')
-                    if len(segments) >= 4:  # 少なくとも4つのセグメントがあることを確認
-                        label = segments[3].strip()
-                        if label:
-                            raw_labels.append(label)
-                    else:
-                        info["skipped_count"] += 1
-                        info["skipped_labels"].append((entity.dxftype(), "セミコロン区切りの4番目の要素が存在しない"))
-            except AttributeError:
-                 info["skipped_count"] += 1
-                 info["skipped_labels"].append((entity.dxftype(), "AttributeError"))
-            except Exception as e:
-                info["skipped_count"] += 1
-                info["skipped_labels"].append((entity.dxftype(), str(e)))
-                print(f"警告: エンティティ処理スキップ: {entity.dxftype()} - {str(e)}", file=sys.stderr)
-
-        info["total_extracted"] = len(raw_labels)
-        processed_labels = [] # 最終的に出力するラベルリスト
+        raw_labels = iter_mtext_labels(doc.modelspace(), info)
 
+        # 最終的に出力するラベルリスト（抽出しながらフィルター・正規化する）
         if filter_labels:
-            for label in raw_labels:
-                try:
-                    exclude, reason, result_label = is_filtered_label(label)
-                    if not exclude:
-                        if result_label:
-                            processed_labels.append(result_label)
-                    elif reason:
-                         info["filtered_labels_info"].append((label, reason))
-                except Exception as e:
-                    info["skipped_count"] += 1
-                    info["skipped_labels"].append((label, f"Filtering error: {str(e)}"))
-                    print(f"警告: ラベルフィルタリング中にエラー: '{label}' - {str(e)}", file=sys.stderr)
-            info["filtered_count"] = len(raw_labels) - len(processed_labels)
+            labels = filter_raw_labels(raw_labels, info)
+            info["filtered_count"] = info["total_extracted"] - len(labels)
         else:
             # フィルターしない場合でも正規化は行う
             print("情報: --no-filter が指定されたためフィルターは行いませんが、抽出ラベルの正規化（大文字化・トリム）は行います。", file=sys.stderr)
-            for label in raw_labels:
-                normalized_lbl = normalize_label(label)
-                if normalized_lbl:
-                    processed_labels.append(normalized_lbl)
+            labels = normalize_raw_labels(raw_labels)
             info["filtered_count"] = 0 # フィルターによる除外はない
 
         # ソート処理
-        labels = processed_labels # 最終リストを labels に代入
         if sort_order == 'asc':
             labels.sort()
         elif sort_order == 'desc':
@@ -191,7 +230,7 @@ def ensure_file_extension(filename, default_ext):
     return filename
 
 # --- main (拡張子処理改善) ---
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description='DXFファイルからMTEXT要素のラベルを抽出・フィルタリングし、テキストファイルに出力します。',
         formatter_class=argparse.RawTextHelpFormatter
@@ -212,7 +251,7 @@ def main():
     parser.add_argument('--verbose', '-v', action='store_true',
                         help='フィルタリングで除外されたラベルとその理由を標準エラー出力に表示します。')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # 拡張子を追加
     input_dxf = ensure_file_extension(args.input_dxf, '.dxf')
@@ -264,8 +303,10 @@ def main():
         # ラベルをファイルに書き込み
         try:
             with open(output_file, 'w', encoding='utf-8') as f:
-                for label in labels:
-                    f.write(label + "\n")
+                # まとめて1回で書き込む (ラベルが無い場合は空ファイルのまま)
+                if labels:
+                    f.write("\n".join(labels))
+                    f.write("\n")
         except Exception as e:
              print(f"エラー: 出力ファイル '{output_file}' への書き込み失敗: {str(e)}", file=sys.stderr)
              return 1
@@ -1,87 +1,108 @@
 #!/usr/bin/env python
 import sys
-import ezdxf
 import argparse
-from io import StringIO
 import os
-
-try:
-    from ezdxf.lldxf.writer import TagWriter  # ezdxf >= 0.19
-except ImportError:
-    from ezdxf.lldxf.tagwriter import TagWriter  # ezdxf < 0.19
-
-def get_group_code_meaning(code):
-    code_meanings = {
-        0: "Entity Type", 1: "Primary Text String", 2: "Name", 3: "Additional Text",
-        5: "Handle", 6: "Linetype", 7: "Text Style Name", 8: "Layer Name", 9: "Variable Name",
-        10: "X Coordinate (Main)", 20: "Y Coordinate (Main)", 30: "Z Coordinate (Main)",
-        40: "Double Precision Value", 50: "Angle", 62: "Color Number", 70: "Integer Value",
-        210: "X Direction Vector", 220: "Y Direction Vector", 230: "Z Direction Vector", 999: "Comment"
-    }
-    return code_meanings.get(code, "Other")
-
-def extract_hierarchy(doc):
-    hierarchy = []
-
+import functools
+
+# グループコードとその意味（呼び出しのたびに辞書を作らないようモジュールレベルで定義）
+GROUP_CODE_MEANINGS = {
+    0: "Entity Type", 1: "Primary Text String", 2: "Name", 3: "Additional Text",
+    5: "Handle", 6: "Linetype", 7: "Text Style Name", 8: "Layer Name", 9: "Variable Name",
+    10: "X Coordinate (Main)", 20: "Y Coordinate (Main)", 30: "Z Coordinate (Main)",
+    40: "Double Precision Value", 50: "Angle", 62: "Color Number", 70: "Integer Value",
+    210: "X Direction Vector", 220: "Y Direction Vector", 230: "Z Direction Vector", 999: "Comment"
+}
+
+# 出力するテーブル名と、対応する Drawing の属性名
+TABLE_ATTRS = (
+    ('LAYERS', 'layers'),
+    ('LTYPE', 'linetypes'),
+    ('STYLES', 'styles'),
+    ('DIMSTYLES', 'dimstyles'),
+    ('UCS', 'ucs'),
+)
+
+def write_hierarchy(doc, f):
+    """
+    DXFの階層構造をMarkdownとしてファイル f に書き出す
+    （全体をリストにためず、エントリ・エンティティごとにまとめて出力して大きな図面でもメモリを抑える）
+    """
     # HEADER
-    hierarchy.append("# SECTION: HEADER")
+    f.write("# SECTION: HEADER\n")
 
     # TABLES
-    hierarchy.append("# SECTION: TABLES")
-    for table_name, table in {
-        'LAYERS': doc.layers,
-        'LTYPE': doc.linetypes,
-        'STYLES': doc.styles,
-        'DIMSTYLES': doc.dimstyles,
-        'UCS': doc.ucs
-    }.items():
-        hierarchy.append(f"## TABLE: {table_name}")
+    f.write("# SECTION: TABLES\n")
+    for table_name, attr in TABLE_ATTRS:
+        table = getattr(doc, attr)
+        f.write(f"## TABLE: {table_name}\n")
         for entry in table:
-            hierarchy.append(f"### ENTRY: {entry.dxf.name}")
-            for key, value in entry.dxf.all_existing_dxf_attribs().items():
-                hierarchy.append(f"- {key}: {value}")
+            f.write("\n".join([
+                f"### ENTRY: {entry.dxf.name}",
+                *(f"- {key}: {value}" for key, value in entry.dxf.all_existing_dxf_attribs().items()),
+                ""
+            ]))
 
     # BLOCKS
-    hierarchy.append("# SECTION: BLOCKS")
+    f.write("# SECTION: BLOCKS\n")
     for block in doc.blocks:
-        hierarchy.append(f"## BLOCK: {block.name}")
+        f.write(f"## BLOCK: {block.name}\n")
         for entity in block:
-            hierarchy.append(f"### ENTITY: {entity.dxftype()}")
-            hierarchy.extend(get_sorted_entity_tags(entity))
+            f.write("\n".join([f"### ENTITY: {entity.dxftype()}", *get_sorted_entity_tags(entity), ""]))
 
     # ENTITIES
-    hierarchy.append("# SECTION: ENTITIES")
+    f.write("# SECTION: ENTITIES\n")
     msp = doc.modelspace()
     for entity in msp:
-        hierarchy.append(f"## ENTITY: {entity.dxftype()}")
-        hierarchy.extend(get_sorted_entity_tags(entity))
+        f.write("\n".join([f"## ENTITY: {entity.dxftype()}", *get_sorted_entity_tags(entity), ""]))
 
     # OBJECTS
-    hierarchy.append("# SECTION: OBJECTS")
+    f.write("# SECTION: OBJECTS\n")
     for obj in doc.objects:
-        hierarchy.append(f"## OBJECT: {obj.dxftype()}")
-        hierarchy.extend(get_sorted_entity_tags(obj))
+        f.write("\n".join([f"## OBJECT: {obj.dxftype()}", *get_sorted_entity_tags(obj), ""]))
 
     # CLASSES
-    hierarchy.append("# SECTION: CLASSES (if present)")
+    f.write("# SECTION: CLASSES (if present)\n")
 
-    return hierarchy
+@functools.lru_cache(maxsize=None)
+def get_tag_row_collector_class():
+    """
+    TagRowCollector クラスを返す
+    （基底クラスのために ezdxf を読み込む必要があるため、モジュールの読み込み時ではなく初めて使う時点で作成する）
+    """
+    from ezdxf.lldxf.tagwriter import AbstractTagWriter
+
+    class TagRowCollector(AbstractTagWriter):
+        """
+        export_dxf() が書き出すタグを (グループコード, 値) の組として集める
+        （TagWriter で文字列に書き出してから読み直す往復を省く。値の文字列表現は TagWriter と同じ）
+        """
+        def __init__(self):
+            self.tags = []
+
+        def write_tag2(self, code, value):
+            if code >= 0:
+                self.tags.append((code, str(value).strip()))
+
+        def write_tag(self, tag):
+            self.write_str(tag.dxfstr())
+
+        def write_str(self, s):
+            lines = s.split('\n')
+            for i in range(0, len(lines)-1, 2):
+                code = lines[i].strip()
+                if code.isdigit():
+                    self.tags.append((int(code), lines[i+1].strip()))
+
+    return TagRowCollector
+
+def collect_tags(entity):
+    """エンティティの export_dxf() が書き出すタグを (グループコード, 値) の組のリストとして返す"""
+    collector = get_tag_row_collector_class()()
+    entity.export_dxf(collector)
+    return collector.tags
 
 def get_sorted_entity_tags(entity):
-    buffer = StringIO()
-    tagwriter = TagWriter(buffer)
-    entity.export_dxf(tagwriter)
-    buffer.seek(0)
-    lines = buffer.readlines()
-
-    tags = []
-    for i in range(0, len(lines)-1, 2):
-        code = lines[i].strip()
-        value = lines[i+1].strip()
-        if code.isdigit():
-            code_int = int(code)
-            meaning = get_group_code_meaning(code_int)
-            tags.append((code_int, meaning, value))
+    tags = [(code, GROUP_CODE_MEANINGS.get(code, "Other"), value) for code, value in collect_tags(entity)]
 
     tags.sort(key=lambda x: x[0])
 
@@ -103,11 +124,11 @@ def get_default_output_filename(input_dxf):
     name, _ = os.path.splitext(base)
     return f"{name}_hierarchy.md"
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description='DXF階層構造をMarkdownで出力')
     parser.add_argument('input_dxf', help='入力DXFファイル')
     parser.add_argument('output_file', nargs='?', help='出力ファイル（.md）。指定しない場合は自動生成')
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # 入力ファイル名に拡張子を追加
     input_dxf = ensure_file_extension(args.input_dxf, '.dxf')
@@ -115,7 +136,7 @@ def main():
     # 入力ファイルの存在確認
     if not os.path.exists(input_dxf):
         print(f"エラー: 入力ファイル '{input_dxf}' が見つかりません")
-        sys.exit(1)
+        return 1
 
     # 出力ファイル名の処理
     if args.output_file is None:
@@ -141,20 +162,22 @@ def main():
             print(f"出力ディレクトリ '{output_dir}' を作成しました")
         except Exception as e:
             print(f"エラー: 出力ディレクトリ '{output_dir}' を作成できません: {str(e)}")
-            sys.exit(1)
+            return 1
 
     try:
+        # ezdxf の読み込みは重いため、--help や引数エラーで終わる場合に読み込まないよう、使う時点で import する
+        import ezdxf
         doc = ezdxf.readfile(input_dxf)
-        hierarchy = extract_hierarchy(doc)
 
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for line in hierarchy:
-                f.write(line + "\n")
+        with open(output_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
+            write_hierarchy(doc, f)
 
         print(f"Markdown出力完了: {output_file}")
     except Exception as e:
         print(f"エラーが発生しました: {str(e)}")
-        sys.exit(1)
+        return 1
+
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
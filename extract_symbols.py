@@ -1,12 +1,20 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import pandas as pd
 import argparse
+import functools
 import os
 import re
 import sys
 
+# 回路記号の先頭の連続したアルファベット（呼び出しごとにコンパイル・キャッシュ検索しないよう、モジュール読み込み時にコンパイル）
+ALPHABETIC_PREFIX_PATTERN = re.compile(r'^([A-Za-z]+)')
+
+# 不足分の補完に使う連番サフィックス "-X001"～"-X999"（行ごとに書式化しないよう事前に作成）
+FILL_SUFFIXES = [f"-X{i:03d}" for i in range(1, 1000)]
+
+# R, C など同じ接頭辞の回路記号は何度も現れるため、抽出結果を記号ごとにキャッシュする
+@functools.lru_cache(maxsize=4096)
 def extract_alphabetic_part(symbol):
     """
     回路記号からアルファベット部分を抽出する
@@ -18,7 +26,7 @@ def extract_alphabetic_part(symbol):
         str: アルファベット部分
     """
     # アルファベット部分（先頭の連続したアルファベット）を抽出
-    match = re.match(r'^([A-Za-z]+)', symbol)
+    match = ALPHABETIC_PREFIX_PATTERN.match(symbol)
     if match:
         return match.group(1)
     return ""
@@ -45,29 +53,71 @@ def extract_assembly_number_from_filename(filename):
     # '_'がない場合はファイル名全体をアセンブリ番号として返す
     return base_name
 
-def find_all_possible_assembly_numbers(df):
+def get_drawing_numbers(df, np):
+    """
+    図面番号列を行ごとの判定用の配列にまとめる（行ごとに df.iloc / iterrows を呼ばずに済むようにする）
+    
+    Args:
+        df (pandas.DataFrame): Excelファイルから読み込んだデータフレーム
+        np (module): 呼び出し側で import した numpy モジュール
+        
+    Returns:
+        tuple: (文字列化した図面番号, 図面番号があるか, 図面番号が空白か) の NumPy 配列
+    """
+    values = df["図面番号"].tolist()
+    present = df["図面番号"].notna().to_numpy()
+    text = np.array([str(value) for value in values], dtype=object)
+    # 図面番号が欠損、または空白文字だけの行を空白行とみなす
+    blank = np.array([not has_value or not value.strip() for has_value, value in zip(present, text)], dtype=bool)
+    return text, present, blank
+
+def build_assembly_blocks(drawing_numbers, np, pd):
+    """
+    図面番号ごとに、最初に現れた行の次の行から図面番号が空白の行が続く範囲をまとめて求める
+    （アセンブリ番号ごとに全行を走査し直さず、1回の走査で全アセンブリの処理対象行を決める）
+    
+    Args:
+        drawing_numbers (tuple): get_drawing_numbers の戻り値
+        np (module): 呼び出し側で import した numpy モジュール
+        pd (module): 呼び出し側で import した pandas モジュール
+        
+    Returns:
+        dict: 図面番号 -> 処理対象行の位置 (range)
+    """
+    text, present, blank = drawing_numbers
+    
+    # 図面番号ごとに最初に現れた行だけを残す
+    header_rows = np.flatnonzero(present)
+    first_rows = pd.Series(text[header_rows]).drop_duplicates(keep='first')
+    headers = header_rows[first_rows.index.to_numpy()]
+    
+    # 一致した行は処理対象外。その次の行から、図面番号が空白でない最初の行の手前までを処理対象とする
+    starts = headers + 1
+    non_blank_rows = np.append(np.flatnonzero(~blank), len(blank))
+    ends = non_blank_rows[np.searchsorted(non_blank_rows, starts)]
+    
+    return {number: range(int(start), int(end)) for number, start, end in zip(first_rows.tolist(), starts, ends)}
+
+def find_all_possible_assembly_numbers(df, np, drawing_numbers=None):
     """
     Excelファイル内の全ての可能なアセンブリ番号（図面番号）を抽出する
     図面番号の下に空白行がある図面番号のみを対象とする
     
     Args:
         df (pandas.DataFrame): Excelファイルから読み込んだデータフレーム
+        np (module): 呼び出し側で import した numpy モジュール
+        drawing_numbers (tuple): get_drawing_numbers の戻り値（省略時は df から作成）
         
     Returns:
         list: 可能なアセンブリ番号のリスト
     """
-    possible_assemblies = []
-    
-    for i in range(len(df) - 1):  # 最後の行は次の行がないので対象外
-        current_row = df.iloc[i]
-        next_row = df.iloc[i + 1]
-        
-        # 現在の行に図面番号があり、次の行の図面番号が空白の場合
-        if (pd.notna(current_row["図面番号"]) and 
-            (pd.isna(next_row["図面番号"]) or str(next_row["図面番号"]).strip() == "")):
-            possible_assemblies.append(str(current_row["図面番号"]))
+    if drawing_numbers is None:
+        drawing_numbers = get_drawing_numbers(df, np)
+    text, present, blank = drawing_numbers
     
-    return possible_assemblies
+    # 現在の行に図面番号があり、次の行の図面番号が空白の場合（最後の行は次の行がないので対象外）
+    candidates = np.flatnonzero(present[:-1] & blank[1:])
+    return [text[i] for i in candidates]
 
 def extract_circuit_symbols(input_excel, output_txt, use_all_assemblies=False, include_maker_info=False):
     """
@@ -82,6 +132,10 @@ def extract_circuit_symbols(input_excel, output_txt, use_all_assemblies=False, i
     Returns:
         bool: 成功した場合はTrue、失敗した場合はFalse
     """
+    # pandas / NumPy の読み込みは重いため、--help や引数エラーで終わる場合に読み込まないよう、使う時点で import する
+    # （補助関数にはここで読み込んだモジュールを渡す）
+    import numpy as np
+    import pandas as pd
     try:
         # アセンブリ番号をファイル名から抽出
         filename = os.path.basename(input_excel)
@@ -89,26 +143,31 @@ def extract_circuit_symbols(input_excel, output_txt, use_all_assemblies=False, i
         
         print(f"ファイル名から抽出されたアセンブリ番号: {suggested_assembly_number}")
         
-        # Excelファイルを読み込む（1行目をヘッダーとして）
-        df = pd.read_excel(input_excel)
-        
-        # ファイルが存在し、必要な列があるか確認
+        # 必要な列
         required_columns = ["符号", "構成コメント", "構成数", "図面番号"]
         
         # メーカー情報を含める場合は追加の列が必要
         if include_maker_info:
             required_columns.extend(["メーカ名", "メーカ型式"])
         
+        # Excelファイルを読み込む（1行目をヘッダーとして、使わない列は読み込まない）
+        df = pd.read_excel(input_excel, usecols=lambda column: column in required_columns)
+        
+        # ファイルが存在し、必要な列があるか確認
         for col in required_columns:
             if col not in df.columns:
                 raise ValueError(f"'{col}'列がExcelファイルに見つかりません")
         
+        # 図面番号列の判定結果と、アセンブリごとの処理対象行をまとめて作成しておく
+        drawing_numbers = get_drawing_numbers(df, np)
+        assembly_blocks = build_assembly_blocks(drawing_numbers, np, pd)
+        
         # 使用するアセンブリ番号のリストを初期化
         assembly_numbers = []
         
         # 全てのアセンブリを使用するオプションが有効な場合
         if use_all_assemblies:
-            possible_assemblies = find_all_possible_assembly_numbers(df)
+            possible_assemblies = find_all_possible_assembly_numbers(df, np, drawing_numbers)
             if possible_assemblies:
                 assembly_numbers = possible_assemblies
                 print(f"検出された可能なアセンブリ番号: {', '.join(assembly_numbers)}")
@@ -118,12 +177,9 @@ def extract_circuit_symbols(input_excel, output_txt, use_all_assemblies=False, i
                 assembly_numbers = [suggested_assembly_number]
         else:
             # 抽出されたアセンブリ番号が図面番号に存在するか確認
-            assembly_found = False
-            for i, row in df.iterrows():
-                if pd.notna(row["図面番号"]) and str(row["図面番号"]) == suggested_assembly_number:
-                    assembly_numbers = [suggested_assembly_number]
-                    assembly_found = True
-                    break
+            assembly_found = suggested_assembly_number in assembly_blocks
+            if assembly_found:
+                assembly_numbers = [suggested_assembly_number]
             
             # アセンブリ番号が見つからなかった場合は、ファイル名全体を使用
             if not assembly_found:
@@ -133,6 +189,14 @@ def extract_circuit_symbols(input_excel, output_txt, use_all_assemblies=False, i
             else:
                 print(f"アセンブリ番号として採用: {suggested_assembly_number}")
         
+        # 使用する列の値と、欠損でないかの判定を行ごとのリストにまとめて取り出しておく
+        # （行ごとに列名で参照したり pd.notna を呼んだりしないようにする）
+        symbol_columns = ["構成コメント", "符号", "構成数"]
+        if include_maker_info:
+            symbol_columns.extend(["メーカ名", "メーカ型式"])
+        row_values = df[symbol_columns].to_numpy(dtype=object).tolist()
+        row_present = df[symbol_columns].notna().to_numpy().tolist()
+        
         # すべての回路記号を格納するリスト
         all_circuit_symbols = []
         
@@ -141,22 +205,7 @@ def extract_circuit_symbols(input_excel, output_txt, use_all_assemblies=False, i
             print(f"===== アセンブリ番号 '{assembly_number}' の処理を開始 =====")
             
             # 処理対象の行を特定
-            start_processing = False
-            processing_rows = []
-            
-            for i, row in df.iterrows():
-                # アセンブリ番号と一致する図面番号を探す
-                if not start_processing and pd.notna(row["図面番号"]) and str(row["図面番号"]) == assembly_number:
-                    start_processing = True
-                    continue  # 一致した行は処理対象外
-                
-                # 処理開始後、図面番号が空白の行を処理対象とする
-                if start_processing:
-                    if pd.isna(row["図面番号"]) or str(row["図面番号"]).strip() == "":
-                        processing_rows.append(i)
-                    else:
-                        # 図面番号が空白でなくなったら処理終了
-                        break
+            processing_rows = assembly_blocks.get(assembly_number, range(0))
             
             print(f"処理対象行数: {len(processing_rows)}")
             
@@ -167,21 +216,25 @@ def extract_circuit_symbols(input_excel, output_txt, use_all_assemblies=False, i
             # 回路記号リストを格納するリスト
             circuit_symbols = []
             
-            # 処理対象の行だけを処理
-            for idx in processing_rows:
-                row = df.iloc[idx]
+            # 処理対象の行だけを切り出して処理する
+            block_values = row_values[processing_rows.start:processing_rows.stop]
+            block_present = row_present[processing_rows.start:processing_rows.stop]
+            
+            for values, present in zip(block_values, block_present):
+                comment, symbol_value, quantity = values[:3]
+                has_comment, has_symbol, has_quantity = present[:3]
                 
                 # 符号または構成コメントからシンボルを取得
-                if pd.notna(row["構成コメント"]) and "_" in str(row["構成コメント"]):
+                if has_comment and "_" in str(comment):
                     # 構成コメントに"_"が含まれる場合はそちらを使用
-                    base_symbols = str(row["構成コメント"]).split("_")
+                    base_symbols = str(comment).split("_")
                 else:
                     # そうでなければ符号を使用
-                    symbol_str = str(row["符号"]) if pd.notna(row["符号"]) else ""
+                    symbol_str = str(symbol_value) if has_symbol else ""
                     base_symbols = symbol_str.split("_") if "_" in symbol_str else [symbol_str]
                 
                 # 数値型の場合は整数に変換する
-                qty = int(row["構成数"]) if pd.notna(row["構成数"]) else 0
+                qty = int(quantity) if has_quantity else 0
                 
                 # 空文字列を除外
                 base_symbols = [s for s in base_symbols if s.strip()]
@@ -189,8 +242,8 @@ def extract_circuit_symbols(input_excel, output_txt, use_all_assemblies=False, i
                 # 回路記号の個数を取得
                 symbol_count = len(base_symbols)
                 
-                # 最終的なシンボルリスト
-                final_symbols = base_symbols.copy()
+                # 最終的なシンボルリスト（base_symbols は上の内包表記で作った新しいリストなので複製せずに使う）
+                final_symbols = base_symbols
                 
                 # 回路記号の個数と構成数を比較
                 if symbol_count < qty:
@@ -201,8 +254,10 @@ def extract_circuit_symbols(input_excel, output_txt, use_all_assemblies=False, i
                     
                     # 不足分は"rrrrr-Xddd"で補完
                     # rrrrrはアルファベット部分、dddは行ごとに001からのシーケンス番号
-                    for i in range(qty - symbol_count):
-                        final_symbols.append(f"{last_alpha}-X{i+1:03d}")
+                    fill_count = qty - symbol_count
+                    final_symbols.extend(last_alpha + suffix for suffix in FILL_SUFFIXES[:fill_count])
+                    # 1000個目以降は4桁以上になるため個別に書式化する
+                    final_symbols.extend(f"{last_alpha}-X{i:03d}" for i in range(len(FILL_SUFFIXES) + 1, fill_count + 1))
                 elif symbol_count > qty:
                     # 超過分は最後から?をつける
                     final_symbols = final_symbols[:qty]
@@ -212,8 +267,8 @@ def extract_circuit_symbols(input_excel, output_txt, use_all_assemblies=False, i
                 
                 # メーカー情報を含める場合
                 if include_maker_info:
-                    maker_name = str(row["メーカ名"]) if pd.notna(row["メーカ名"]) else ""
-                    maker_model = str(row["メーカ型式"]) if pd.notna(row["メーカ型式"]) else ""
+                    maker_name = str(values[3]) if present[3] else ""
+                    maker_model = str(values[4]) if present[4] else ""
                     
                     # 各シンボルにメーカー情報を追加
                     symbols_with_info = []
@@ -234,8 +289,10 @@ def extract_circuit_symbols(input_excel, output_txt, use_all_assemblies=False, i
         
         # テキストファイルに書き込み
         with open(output_txt, 'w', encoding='utf-8') as f:
-            for symbol in all_circuit_symbols:
-                f.write(f"{symbol}\n")
+            # まとめて1回で書き込む (回路記号が無い場合は空ファイルのまま)
+            if all_circuit_symbols:
+                f.write("\n".join(all_circuit_symbols))
+                f.write("\n")
         
         print(f"回路記号リスト抽出完了。合計 {len(all_circuit_symbols)} 個の回路記号を抽出しました。")
         print(f"出力ファイル: {output_txt}")
@@ -262,7 +319,7 @@ def get_default_output_filename(input_excel):
     base, ext = os.path.splitext(input_excel)
     return f"{base}.txt"
 
-def main():
+def main(argv=None):
     # コマンドライン引数を解析
     parser = argparse.ArgumentParser(description='Excelファイルから回路記号リストを抽出します')
     parser.add_argument('input_excel', help='入力Excelファイルのパス')
@@ -272,7 +329,7 @@ def main():
     parser.add_argument('--include-maker', '-m', action='store_true',
                         help='メーカー名とメーカー型式を出力に含める')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     # 入力ファイル名に拡張子を追加
     input_excel = ensure_file_extension(args.input_excel, '.xlsx')